@@ -17,6 +17,7 @@ def _(
     flowchart_subtitle_hstack,
     full_title,
     history_str,
+    live_run_section,
     mo,
     plot_mode_radio,
     plot_mode_title,
@@ -72,10 +73,12 @@ def _(
             "\u200b", 
 
             secondary_plot_subtitle, 
-            mo.mpl.interactive(fig2), 
+            mo.image(fig2) if isinstance(fig2, bytes) else mo.mpl.interactive(fig2), # PNG bytes if fig2 came from fig2_cache's disk cache 
             "\u200b", 
             mo.md("---"), 
 
+            live_run_section, 
+
         ], 
         gap=0.7 
     ) 
@@ -447,6 +450,7 @@ def _(
 def _(
     available_substages,
     comparison_mode_radio,
+    figure_reuse,
     flowchart_switch,
     mo,
     mpatches,
@@ -510,6 +514,7 @@ def _(
 
         fig, ax = plt.subplots(figsize=(15, 5))
         fig.subplots_adjust(top=0.95, bottom=0.16, left=0.07, right=1)
+        figure_reuse.close_superseded("flowchart", fig) # Close the previous flowchart so old figures don't pile up in pyplot 
 
         if comparison_mode_radio.value==ui_options.COMPAREMODE_NOSELECTION: 
             custom_yticks = unique_masses 
@@ -634,18 +639,26 @@ def _(
 def _(
     HR_diagram_plotting,
     comparison_mode_radio,
-    histories_dict,
+    eep_cube,
+    fig2_cache,
+    figure_reuse,
     history_plot_dropdown,
+    load_data,
     model_selected,
     plot_mode_radio,
     plt,
     profile_plot_dropdown,
     profile_plot_x_dropdown,
     profile_plotting,
-    profiles_dict,
+    stellar_grid,
     ui_options,
 ):
     # Create figure showing interior plot 
+    # Views that were already shown (same plot, mass, model, and options) come from fig2_cache instead of being plotted again 
+    # Each key also has the current signature of every run in the plot (read from its files each time), so once a run's files 
+    # change (i.e. a run that's still going), its old figures aren't shown 
+    def data_signature(masses): 
+        return str([load_data.run_signature(mass_i) for mass_i in masses]) 
 
 
 
@@ -657,7 +670,7 @@ def _(
 
         # Create small figure with an error message 
         def make_error_figure(message="Error"):
-                fig, ax = plt.subplots(figsize=(6, 3))
+                fig, ax = figure_reuse.get_figure("error", figsize=(6, 3))
                 ax.text(0.5, 0.5, message, ha="center", va="center", fontsize=12, color="gray")
                 ax.axis("off")
                 fig.tight_layout()
@@ -669,30 +682,49 @@ def _(
 
 
 
-        # Otherwise, load history and profile for selected mass/modelnum from preloaded dictionaries 
+        # Otherwise, get the selected mass/modelnum. Histories and profiles are loaded from the grid only when a plot needs them 
         mass_selected = model_selected.mass 
         modelnum_selected = model_selected.model_example 
-        profile = profiles_dict[(mass_selected, modelnum_selected)]
-        history = histories_dict[mass_selected]
+        if mass_selected not in stellar_grid.masses: 
+            return make_error_figure(f"No MESA output found for a {mass_selected} $M_{{sun}}$ star") 
 
 
 
         # HR Diagram 
         if plot_mode_radio.value == ui_options.PLOTMODE_HRDIAGRAM: 
-            hr = HR_diagram_plotting.HRDiagram() 
-        
-            if comparison_mode_radio.value == ui_options.COMPAREMODE_MASSFIRST: 
-                colors = dict(zip(histories_dict.keys(), ["tab:blue", "tab:orange", "tab:green", "tab:red"]))
-                for mass_i, history_i in histories_dict.items(): 
-                    if mass_i == mass_selected: 
-                        hr.add_path(history_i, label=f"{history_i.star_mass[0]:.1f} $M_{{sun}}$", color=colors[mass_i])
-                    else: 
-                        hr.add_path(history_i, label=f"{history_i.star_mass[0]:.1f} $M_{{sun}}$", color=colors[mass_i], alpha=0.3)
-
-                
-            hr.label_spectraltypes() 
-            hr.legend() 
-            fig2 = hr.fig 
+
+            def plot_hr_diagram(): 
+                hr = HR_diagram_plotting.HRDiagram() 
+
+                # Every mass's track is drawn as one artist, colored by mass (see the colorbar), with the selected mass highlighted 
+                if comparison_mode_radio.value == ui_options.COMPAREMODE_MASSFIRST: 
+                    histories = [stellar_grid.history(mass_i, columns=ui_options.HRDIAGRAM_COLUMNS) for mass_i in stellar_grid.masses] 
+                    hr.add_paths(
+                        [history_i.log_Teff for history_i in histories], 
+                        [history_i.log_L for history_i in histories], 
+                        stellar_grid.masses, 
+                        highlight=mass_selected) 
+
+                # Same stage for every mass: slice the selected stage's EEPs out of the EEP cube (built the first time it's needed) 
+                if comparison_mode_radio.value == ui_options.COMPAREMODE_STAGEFIRST: 
+                    cube = eep_cube.get_eep_cube() 
+                    stage_eeps = cube.segment(eep_cube.STAGE_SEGMENTS[model_selected.parent_substage.parent_stage]) 
+                    hr.add_paths(
+                        cube.column("log_Teff")[:, stage_eeps], 
+                        cube.column("log_L")[:, stage_eeps], 
+                        cube.masses, 
+                        highlight=mass_selected) 
+
+                hr.label_spectraltypes() 
+                return hr.fig 
+
+            # Stage-first plots only depend on the selected stage, mass-first plots only on the selected mass 
+            if comparison_mode_radio.value == ui_options.COMPAREMODE_STAGEFIRST: 
+                view = model_selected.parent_substage.parent_stage.name 
+            else: 
+                view = None 
+            fig_key = ("hr", comparison_mode_radio.value.display, mass_selected, view, data_signature(stellar_grid.masses)) 
+            fig2 = fig2_cache.get(fig_key, plot_hr_diagram) 
             return fig2
 
 
@@ -700,9 +732,15 @@ def _(
         # History plots 
         if plot_mode_radio.value == ui_options.PLOTMODE_HISTORY: 
 
-            selected_plot_func = history_plot_dropdown.value.plot_func 
-            fig2 = selected_plot_func(history) 
-            # history_plotting.add_substage_highlight(fig2, model_selected, history) 
+            def plot_history(): 
+                history = stellar_grid.history(mass_selected, columns=history_plot_dropdown.value.columns) 
+                selected_plot_func = history_plot_dropdown.value.plot_func 
+                fig = selected_plot_func(history) 
+                # history_plotting.add_substage_highlight(fig, model_selected, history) 
+                return fig 
+
+            fig_key = ("history", history_plot_dropdown.value.display, mass_selected, data_signature([mass_selected])) 
+            fig2 = fig2_cache.get(fig_key, plot_history) 
             return fig2 
 
 
@@ -710,11 +748,6 @@ def _(
         # Interior profile plots 
         if plot_mode_radio.value == ui_options.PLOTMODE_PROFILE:
 
-            # Create profile plot depending on selected options in dropdown 
-            selected_plot_func = profile_plot_dropdown.value.plot_func 
-            selected_x_axis = profile_plot_x_dropdown.value  
-            fig2 = selected_plot_func(profile, selected_x_axis, history)
-
             # List of strings used in the title (i.e., "Interior composition of a" + "Subgiant" (with red text) + "star")
             if comparison_mode_radio.value == ui_options.COMPAREMODE_MASSFIRST: 
                 substage_str = model_selected.parent_substage.mode1_interior_plot_title
@@ -727,8 +760,25 @@ def _(
             substage_color = model_selected.parent_substage.flowchart_color 
             title_colors_list = ['black', substage_color, 'black'] 
 
-            # Add colored region to title 
-            profile_plotting.add_colored_title(fig2, title_str_list, title_colors_list, fontsize=20) 
+            def plot_profile(): 
+
+                # Create profile plot depending on selected options in dropdown 
+                # Only the columns used by the selected plot and x axis are loaded 
+                selected_plot_func = profile_plot_dropdown.value.plot_func 
+                selected_x_axis = profile_plot_x_dropdown.value  
+                profile_columns = profile_plot_dropdown.value.columns + selected_x_axis.columns 
+                history = stellar_grid.history(mass_selected, columns=profile_plot_dropdown.value.history_columns) 
+                profile = stellar_grid.profile(mass_selected, modelnum_selected, columns=profile_columns) 
+                stellar_grid.prefetch_neighbors(mass_selected, profile.modelnum, columns=profile_columns) # Load the previous/next profiles in the background 
+                fig = selected_plot_func(profile, selected_x_axis, history)
+
+                # Add colored region to title 
+                profile_plotting.add_colored_title(fig, title_str_list, title_colors_list, fontsize=20) 
+                return fig 
+
+            fig_key = ("profile", profile_plot_dropdown.value.display, profile_plot_x_dropdown.value.display, mass_selected, modelnum_selected, 
+                       tuple(title_str_list), substage_color, data_signature([mass_selected])) 
+            fig2 = fig2_cache.get(fig_key, plot_profile) 
             return fig2
 
 
@@ -748,65 +798,128 @@ def _(
 
 
 @app.cell(hide_code=True)
-def _(load_data, mo, stellar_evolution_data):
-    # Preload profiles and histories 
+def _(figure_cache):
+    # Figures of the views that were already shown, so switching back to one doesn't plot it again 
+    # The least recently used figures are closed once they take more than max_bytes (or there are more than max_figures) 
+    # Set cache_dir to also save every figure as a PNG, so views shown in an earlier session are shown right away (as static images) 
+    fig2_cache = figure_cache.FigureCache(max_bytes=128*2**20, max_figures=12, cache_dir=None) 
+    return (fig2_cache,)
 
-    fast_load = False  
 
+@app.cell(hide_code=True)
+def _(load_data, mo):
+    # Live run: follow a MESA run that is still going 
+    # Set live_run_folder to the run's LOGS folder (the one with history.data and profiles.index) to show the live run section, 
+    # or None to hide it 
+    live_run_folder = None 
 
+    live_follower = None 
+    live_refresh = None 
+    if live_run_folder is not None: 
+        live_follower = load_data.HistoryFollower(MESA_folder_path=live_run_folder) 
+        live_refresh = mo.ui.refresh(options=["2s", "5s", "10s", "30s"], default_interval="5s", label="Update every") 
 
-    if fast_load == True: 
-        fast_history = load_data.load_history(1.0)
-        fast_profile = load_data.load_profile(1.0, 296, fast_history)
+    return live_follower, live_refresh
 
 
+@app.cell(hide_code=True)
+def _(
+    HR_diagram_plotting,
+    figure_reuse,
+    history_plot_dropdown,
+    live_follower,
+    live_refresh,
+    mo,
+    plot_mode_radio,
+    ui_options,
+):
+    # Live run plot: redrawn every time live_refresh ticks 
+    # Each update only parses the rows MESA has added since the last one, so updates stay fast however long the run gets 
+
+    live_run_section = "" 
+    if live_follower is not None: 
+        live_refresh.value # Re-run this cell each time the refresh timer ticks 
+        live_follower.update() 
+        live_history = live_follower.history 
+
+        # Show the selected history plot if history mode is selected, otherwise the HR diagram 
+        if len(live_history.model_number) == 0: 
+            live_status = mo.md("Waiting for the first rows of history.data...") 
+            live_plot = "" 
+        else: 
+            live_status = mo.md(f"Model {live_history.model_number[-1]}, age {live_history.star_age[-1]:.3e} years, {len(live_history.model_numbers_available)} profiles saved") 
+            # Drawn in figures of its own, so the live plot and the main plot don't reuse the same figure 
+            with figure_reuse.namespace("live"): 
+                if plot_mode_radio.value == ui_options.PLOTMODE_HISTORY: 
+                    live_fig = history_plot_dropdown.value.plot_func(live_history) 
+                else: 
+                    live_hr = HR_diagram_plotting.HRDiagram() 
+                    live_hr.add_path(live_history, label=f"{live_history.star_mass[0]:.1f} $M_{{sun}}$") 
+                    live_hr.label_spectraltypes() 
+                    live_hr.legend() 
+                    live_fig = live_hr.fig 
+            live_plot = mo.mpl.interactive(live_fig) 
+
+        live_run_section = mo.vstack(
+            [
+                mo.md("<h2>Live Run</h2>"), 
+                mo.hstack([live_status, live_refresh], justify="space-between", align="center"), 
+                live_plot, 
+                "\u200b", 
+                mo.md("---"), 
+            ], 
+            gap=0.7 
+        ) 
+
+    return (live_run_section,)
+
+
+@app.cell(hide_code=True)
+def _(load_data, mo, stellar_evolution_data):
+    # Grid of histories and profiles 
+    # Nothing is loaded here: histories and profiles are loaded the first time a plot needs them, 
+    # and the least recently used ones are dropped once the cache holds more than max_bytes 
+
+    # Set to True to load every history and example profile up front, parsing files in parallel (i.e. on a lecture machine before class) 
+    preload_all = False 
 
+    # Keep plotted columns as float32 (half the memory, so about twice as many models fit in max_bytes) 
+    load_data.use_float32 = True 
 
+    # To run from a single bundle file instead of data_folder (i.e. in the browser), make one with utils/export_bundle.py and set its path or URL here 
+    # load_data.data_bundle = "grid.bundle" 
 
 
-    # Get list of all models and masses that need to be loaded  
+
+    # Runs available in the data folder, from its manifest (built by scanning the folder the first time) 
+    grid_catalog = load_data.get_catalog() 
+    available_masses = grid_catalog.masses() 
+
+    # Get list of all models and masses that have a MESA run 
     models_list = [] 
     mass_list = [] 
     for substage in stellar_evolution_data.SUBSTAGES_LIST: 
         for model in substage.models: 
-            models_list.append(model)  
+            if model.mass not in available_masses: 
+                continue 
+            models_list.append((model.mass, model.model_example)) 
             if model.mass not in mass_list: 
                 mass_list.append(model.mass)
 
+    stellar_grid = load_data.StellarGrid(masses=mass_list, max_bytes=512*2**20) 
 
+    if preload_all == True: 
+        stellar_grid.preload(
+            models_list, 
+            progress=lambda finished, total: mo.status.progress_bar(
+                finished, 
+                total=total, 
+                remove_on_exit=True, 
+                title="Loading histories and profiles", 
+            ), 
+        ) 
 
-    # Load histories 
-    histories_dict = {} 
-    for mass in mo.status.progress_bar(
-        mass_list, 
-        remove_on_exit=True, 
-        title="Loading histories", 
-    ): 
-        if mass in histories_dict: 
-            continue 
-        if fast_load == False: 
-            histories_dict[mass] = load_data.load_history(mass) 
-        if fast_load == True: 
-            histories_dict[mass] = fast_history 
-
-
-    # Load profiles 
-    profiles_dict = {} 
-    for model in mo.status.progress_bar(
-        models_list, 
-        remove_on_exit=True, 
-        title="Loading profiles", 
-    ): 
-        mass = model.mass 
-        modelnum = model.model_example 
-        if fast_load == False: 
-            profiles_dict[(mass, modelnum)] = load_data.load_profile(mass, histories_dict[mass], modelnum=modelnum) 
-        if fast_load == True: 
-            profiles_dict[(mass, modelnum)] = fast_profile
-
-
-
-    return histories_dict, profiles_dict
+    return (stellar_grid,)
 
 
 @app.cell(hide_code=True)
@@ -820,7 +933,6 @@ def _():
 
     # Nonstandard packages 
     import marimo as mo
-    import mesa_reader as mr 
 
     plt.style.use('default') # Make sure the plots appear with a white background, even if the user is in dark mode 
 
@@ -831,15 +943,19 @@ def _():
 def _():
     # Packages I wrote 
     import utils.load_data as load_data 
-    return (load_data,)
+    import utils.eep_cube as eep_cube 
+    return eep_cube, load_data
 
 
 @app.cell(hide_code=True)
 def _():
-    import utils.plotting.history_plotting as history_plotting 
-    import utils.plotting.profile_plotting as profile_plotting 
-    import utils.plotting.HR_diagram_plotting as HR_diagram_plotting
-    return HR_diagram_plotting, profile_plotting
+    # Plotting modules (and the parts of matplotlib they use) are imported the first time a plot is drawn, not at startup 
+    import utils.lazy_import as lazy_import 
+    profile_plotting = lazy_import.lazy_module("utils.plotting.profile_plotting") 
+    HR_diagram_plotting = lazy_import.lazy_module("utils.plotting.HR_diagram_plotting") 
+    figure_reuse = lazy_import.lazy_module("utils.plotting.figure_reuse") 
+    figure_cache = lazy_import.lazy_module("utils.plotting.figure_cache") 
+    return HR_diagram_plotting, figure_cache, figure_reuse, profile_plotting
 
 
 @app.cell(hide_code=True)
@@ -1,11 +1,14 @@
 # Define all available options in all dropdown/radio selectors 
 
-import marimo as mo 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Callable
 
-import utils.plotting.history_plotting as history_plotting 
-import utils.plotting.profile_plotting as profile_plotting 
+import utils.lazy_import as lazy_import 
+import utils.config.plot_options as plot_options 
+
+# marimo and the plotting modules (matplotlib) are only imported once a selector is created or a plot is drawn, 
+# so importing this file is cheap 
+mo = lazy_import.lazy_module("marimo") 
 
 
 
@@ -50,26 +53,34 @@ PLOTMODE_PROFILE = PlotModeOption(display="  ")
 
 PLOTMODE_OPTIONS = [PLOTMODE_HRDIAGRAM, PLOTMODE_HISTORY, PLOTMODE_PROFILE]
 
+# History columns used by the HR diagram 
+HRDIAGRAM_COLUMNS = ["log_Teff", "log_L"] 
+
 
 
 
 
 # History plots: Composition, radius, or fusion vs time 
+# columns: the history columns the plot function reads (star_age and star_mass, used by every history plot, are always loaded) 
 @dataclass 
 class HistoryPlotOption(OptionBase): 
     plot_func: Callable  
+    columns: list 
 
 HISTORYPLOT_COMPOSITION = HistoryPlotOption(
     display="Center composition", 
-    plot_func=history_plotting.HistoryPlot.composition) 
+    plot_func=lazy_import.deferred_function("utils.plotting.history_plotting", "HistoryPlot.composition"), 
+    columns=[isotope.history_key for isotope in plot_options.ISOTOPES]) 
 
 HISTORYPLOT_RADIUS = HistoryPlotOption(
     display="Radius", 
-    plot_func=history_plotting.HistoryPlot.radius) 
+    plot_func=lazy_import.deferred_function("utils.plotting.history_plotting", "HistoryPlot.radius"), 
+    columns=["log_R"]) 
 
 HISTORYPLOT_FUSION = HistoryPlotOption(
     display="Fusion rate", 
-    plot_func=history_plotting.HistoryPlot.fusion)
+    plot_func=lazy_import.deferred_function("utils.plotting.history_plotting", "HistoryPlot.fusion"), 
+    columns=["log_LH", "log_LHe", "log_LZ"])
 
 HISTORYPLOT_OPTIONS = [HISTORYPLOT_COMPOSITION, HISTORYPLOT_RADIUS, HISTORYPLOT_FUSION]
 
@@ -78,35 +89,45 @@ HISTORYPLOT_OPTIONS = [HISTORYPLOT_COMPOSITION, HISTORYPLOT_RADIUS, HISTORYPLOT_
 
 
 # Profile plots: composition, convection, etc vs interior coordinate at a fixed point in time 
+# columns: the profile columns the plot function reads (the x axis column comes from ProfileXAxisOption.columns) 
+# history_columns: the history columns the plot function reads, if it uses the history 
 @dataclass
 class ProfilePlotOption(OptionBase):
     plot_func: Callable
     title_str: str
+    columns: list 
+    history_columns: list = field(default_factory=list) 
 
 PROFILEPLOT_COMPOSITION = ProfilePlotOption(
     display="Composition", 
-    plot_func=profile_plotting.ProfilePlot.composition, 
-    title_str="Compostion in interior of a")
+    plot_func=lazy_import.deferred_function("utils.plotting.profile_plotting", "ProfilePlot.composition"), 
+    title_str="Compostion in interior of a", 
+    columns=[isotope.profile_key for isotope in plot_options.ISOTOPES], 
+    history_columns=[isotope.history_key for isotope in plot_options.ISOTOPES if isotope.show_initial_abundance])
 
 PROFILEPLOT_CONVECTION = ProfilePlotOption(
     display="Convection", 
-    plot_func=profile_plotting.ProfilePlot.convection, 
-    title_str="Convective regions in interior of a")
+    plot_func=lazy_import.deferred_function("utils.plotting.profile_plotting", "ProfilePlot.convection"), 
+    title_str="Convective regions in interior of a", 
+    columns=["log_D_conv", "log_D_semi", "log_D_ovr", "log_D_thrm"])
 
 PROFILEPLOT_TEMP = ProfilePlotOption(
     display="Temperature (degeneracy)", 
-    plot_func=profile_plotting.ProfilePlot.temp, 
-    title_str="Temperature in interior of a")
+    plot_func=lazy_import.deferred_function("utils.plotting.profile_plotting", "ProfilePlot.temp"), 
+    title_str="Temperature in interior of a", 
+    columns=["logT", "pressure", "mu", "logRho"])
 
 PROFILEPLOT_TEMPGRAD = ProfilePlotOption(
     display="Temperature gradient (heat transport)", 
-    plot_func=profile_plotting.ProfilePlot.tempgrad, 
-    title_str="Temperature gradient in interior of a")
+    plot_func=lazy_import.deferred_function("utils.plotting.profile_plotting", "ProfilePlot.tempgrad"), 
+    title_str="Temperature gradient in interior of a", 
+    columns=["gradT", "grada", "gradr"])
 
 PROFILEPLOT_FUSION = ProfilePlotOption(
     display="Fusion rate", 
-    plot_func=profile_plotting.ProfilePlot.fusion, 
-    title_str="Fusion in interior of a")
+    plot_func=lazy_import.deferred_function("utils.plotting.profile_plotting", "ProfilePlot.fusion"), 
+    title_str="Fusion in interior of a", 
+    columns=["eps_nuc", "pp", "cno", "tri_alfa", "luminosity"])
 
 PROFILEPLOT_OPTIONS = [PROFILEPLOT_COMPOSITION, PROFILEPLOT_CONVECTION, PROFILEPLOT_TEMP, PROFILEPLOT_TEMPGRAD, PROFILEPLOT_FUSION]
 
@@ -119,16 +140,19 @@ PROFILEPLOT_OPTIONS = [PROFILEPLOT_COMPOSITION, PROFILEPLOT_CONVECTION, PROFILEP
 class ProfileXAxisOption(OptionBase):
     get_values: Callable  # function that takes profile and returns the array 
     xlabel_units: str 
+    columns: list # the profile columns used by get_values 
 
 PROFILEXAXIS_MASS = ProfileXAxisOption(
     display="mass coordinate", 
     get_values=lambda profile: profile.mass, 
-    xlabel_units="(mass coordinate ($M_{{sun}}$))" ) 
+    xlabel_units="(mass coordinate ($M_{{sun}}$))", 
+    columns=["mass"]) 
 
 PROFILEXAXIS_RADIUS = ProfileXAxisOption(
     display="radius coordinate", 
     get_values=lambda profile: profile.radius, 
-    xlabel_units="(radius coordinate ($R_{{sun}}$))" )
+    xlabel_units="(radius coordinate ($R_{{sun}}$))", 
+    columns=["radius"])
 
 PROFILEXAXIS_OPTIONS = [PROFILEXAXIS_MASS, PROFILEXAXIS_RADIUS]
 
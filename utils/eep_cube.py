@@ -0,0 +1,305 @@
+import os
+import json
+import threading
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+import utils.load_data as load_data
+import utils.evolutionary_events as evolutionary_events
+import utils.config.plot_options as plot_options
+from utils.config.stellar_evolution_data import ParentStage
+
+
+
+# Equivalent evolutionary phase (EEP) cube: every history in the grid resampled onto the same set of points, so the same
+# index means the same phase of evolution for every mass (i.e. "halfway through the main sequence").
+# The primary EEPs are the evolutionary events (ZAMS, TAMS, ...; see evolutionary_events). Between two primary EEPs,
+# n_points secondary EEPs are spaced evenly along the track (distance in the HR diagram and in log age).
+# The result is one dense (n_mass, n_eep, n_column) array saved as a .npy file and memory-mapped, so comparing masses at a
+# phase is array slicing. Masses that don't reach a phase (i.e. no helium fusion for 0.2 M_sun) have NaN there.
+# Example usage:
+# cube = eep_cube.get_eep_cube()
+# log_L_at_ZAMS = cube.column("log_L")[:, cube.primary_eeps["ZAMS"]]  # one value per mass
+# ms = cube.segment("MS")
+# ms_tracks_Teff, ms_tracks_L = cube.column("log_Teff")[:, ms], cube.column("log_L")[:, ms]  # every mass's main sequence
+# history_1p5 = eep_cube.interpolate_history(1.5)  # track for a mass between grid points, usable like a loaded history
+CUBE_FILENAME = "eep_cube.npy"  # Saved in data_folder, with its description in eep_cube.json
+CUBE_VERSION = 2  # Bump this if the cube's layout changes, so old cubes get rebuilt
+
+
+
+
+
+@dataclass
+class EEPSegment:
+    """Part of a track between two primary EEPs, resampled to n_points secondary EEPs."""
+    name: str       # Used to select the segment (e.g., cube.segment("MS"))
+    start: str      # Event at the start of the segment ("start" = first row of the history)
+    end: str        # Event at the end of the segment ("end" = last row of the history)
+    n_points: int   # Number of EEPs from start (included) to end (not included: it's the first EEP of the next segment)
+
+
+
+EEP_SEGMENTS = [
+    EEPSegment(name="pre_MS",    start="start",         end="ZAMS",          n_points=100),
+    EEPSegment(name="MS",        start="ZAMS",          end="TAMS",          n_points=200),
+    EEPSegment(name="post_MS",   start="TAMS",          end="He_fusion",     n_points=200),
+    EEPSegment(name="core_He",   start="He_fusion",     end="He_exhaustion", n_points=150),
+    EEPSegment(name="early_AGB", start="He_exhaustion", end="TP_AGB",        n_points=100),
+    EEPSegment(name="TP_AGB",    start="TP_AGB",        end="WD",            n_points=100),
+    EEPSegment(name="WD",        start="WD",            end="end",           n_points=100),  # White dwarf cooling track
+]
+
+# Segment that covers each parent stage of the flowchart
+STAGE_SEGMENTS = {
+    ParentStage.HAYASHI: "pre_MS",
+    ParentStage.HENYEY: "pre_MS",
+    ParentStage.MAIN_SEQUENCE: "MS",
+    ParentStage.POST_MAIN_SEQUENCE: "post_MS",
+    ParentStage.RED_GIANT_BRANCH: "post_MS",
+    ParentStage.HELIUM_IGNITION: "post_MS",
+    ParentStage.HELIUM_MAIN_SEQUENCE: "core_He",
+    ParentStage.ASYMPTOTIC_GIANT_BRANCH: "early_AGB",
+    ParentStage.WHITE_DWARF: "WD",
+}
+
+# History columns stored in the cube. model_number is interpolated too, so an EEP can be traced back to the nearest model
+EEP_COLUMNS = [
+    "model_number", "star_age", "star_mass", "log_Teff", "log_L", "log_R", "log_LH", "log_LHe", "log_LZ",
+] + [isotope.history_key for isotope in plot_options.ISOTOPES]
+
+# Weight of each column in the distance along the track used to space secondary EEPs (log_Teff spans a much smaller range
+# than log_L, so it's weighted up). log10(star_age) is included so phases where the star barely moves in the HR diagram still get EEPs
+METRIC_WEIGHTS = {"log_Teff": 10.0, "log_L": 1.0, "log_star_age": 1.0}
+
+# How columns are interpolated between masses (everything else is linear): star_age in log10, since it changes by orders of
+# magnitude between neighbouring grid masses, and star_mass as a fraction of the initial mass
+LOG_INTERP_COLUMNS = ["star_age"]
+MASS_FRACTION_COLUMNS = ["star_mass"]
+
+
+
+
+
+# Dense cube of EEPs. data: (n_mass, n_eep, n_column) array (memory-mapped if it was loaded from a file)
+class EEPCube:
+
+    def __init__(self, data, masses, columns, primary_eeps, segments):
+        self.data = data
+        self.masses = np.asarray(masses)
+        self.columns = list(columns)
+        self.primary_eeps = dict(primary_eeps) # Event name -> EEP index
+        self.segments = dict(segments) # Segment name -> [first EEP, last EEP + 1]
+        self._interp_table = None
+
+    # (n_mass, n_eep) array of one column
+    def column(self, key):
+        return self.data[:, :, self.columns.index(key)]
+
+    # Slice of EEPs in a segment (i.e. cube.column("log_L")[:, cube.segment("MS")])
+    def segment(self, name):
+        return slice(*self.segments[name])
+
+    def mass_index(self, M):
+        return int(np.argmin(np.abs(self.masses - M)))
+
+    # Nearest saved model number at an EEP for one mass (i.e. to load the profile there), or None if the mass doesn't reach it
+    def model_number(self, M, eep):
+        modelnum = self.column("model_number")[self.mass_index(M), eep]
+        return None if np.isnan(modelnum) else int(round(modelnum))
+
+    # Tracks for any masses between the grid masses: at each EEP, interpolated (linearly in log mass) between the grid masses
+    # on either side. masses: one mass or an array of them. columns: only interpolate these (default: every column of the cube).
+    # Returns an (n_masses, n_eep, n_column) array, with the columns in the order given. EEPs that either neighbouring grid mass doesn't reach are NaN
+    def interpolate(self, masses, columns=None):
+        columns = self.columns if columns is None else list(columns)
+        indices = [self.columns.index(key) for key in columns]
+        masses = np.atleast_1d(np.asarray(masses, dtype=float))
+        if np.any(masses < self.masses[0]-1e-9) or np.any(masses > self.masses[-1]+1e-9):
+            raise ValueError(f"Masses must be between {self.masses[0]} and {self.masses[-1]} M_sun to interpolate")
+
+        # Columns transformed so they're interpolated linearly (computed once per cube)
+        if self._interp_table is None:
+            table = np.array(self.data, dtype=np.float64)
+            for j, key in enumerate(self.columns):
+                if key in LOG_INTERP_COLUMNS:
+                    table[:, :, j] = np.log10(np.maximum(table[:, :, j], 1.0))
+                if key in MASS_FRACTION_COLUMNS:
+                    table[:, :, j] /= self.masses[:, None]
+            self._interp_table = table
+
+        # Bracketing grid masses and weights. Exact grid masses use that mass's track as is (even where the neighbour is NaN)
+        log_masses = np.log10(self.masses)
+        hi = np.clip(np.searchsorted(self.masses, masses), 1, len(self.masses)-1)
+        lo = hi-1
+        w = ((np.log10(masses) - log_masses[lo]) / (log_masses[hi] - log_masses[lo]))[:, None, None]
+        a, b = self._interp_table[lo][:, :, indices], self._interp_table[hi][:, :, indices]
+        out = np.where(w <= 0, a, np.where(w >= 1, b, (1-w)*a + w*b))
+
+        for j, key in enumerate(columns):
+            if key in LOG_INTERP_COLUMNS:
+                out[:, :, j] = 10**out[:, :, j]
+            if key in MASS_FRACTION_COLUMNS:
+                out[:, :, j] *= masses[:, None]
+        return out
+
+
+
+
+
+# Distance along a track (for spacing secondary EEPs), strictly increasing so it can be interpolated on
+def _track_distance(history, rows):
+    steps = [
+        METRIC_WEIGHTS["log_Teff"] * np.diff(np.asarray(history.log_Teff[rows], dtype=float)),
+        METRIC_WEIGHTS["log_L"] * np.diff(np.asarray(history.log_L[rows], dtype=float)),
+        METRIC_WEIGHTS["log_star_age"] * np.diff(np.log10(np.maximum(np.asarray(history.star_age[rows], dtype=float), 1.0))),
+    ]
+    step = np.sqrt(np.nansum(np.square(steps), axis=0))
+    distance = np.concatenate([[0], np.cumsum(step)])
+    return distance + 1e-12*np.arange(len(distance))
+
+
+
+# EEP index where each segment starts, and each primary EEP
+def _layout(segments):
+    starts = np.concatenate([[0], np.cumsum([segment.n_points for segment in segments])]).astype(int)
+    segment_slices = {segment.name: [int(starts[i]), int(starts[i+1])] for i, segment in enumerate(segments)}
+    primary_eeps = {segment.start: int(starts[i]) for i, segment in enumerate(segments)}
+    primary_eeps[segments[-1].end] = int(starts[-1])
+    return segment_slices, primary_eeps, int(starts[-1]) + 1
+
+
+
+# Resample one history onto the EEPs: returns an (n_eep, n_column) array
+def _resample_history(history, columns, segments):
+    _, _, n_eep = _layout(segments)
+    out = np.full((n_eep, len(columns)), np.nan)
+
+    def event_index(name):
+        if name == "start":
+            return 0
+        if name == "end":
+            return len(history.star_age)-1
+        index = getattr(history, f"index_{name}")
+        return None if np.isnan(index) else int(index)
+
+    eep = 0
+    for segment in segments:
+        i_start, i_end = event_index(segment.start), event_index(segment.end)
+        if i_start is not None and i_end is not None and i_end > i_start:
+            rows = slice(i_start, i_end+1)
+            distance = _track_distance(history, rows)
+            targets = np.linspace(distance[0], distance[-1], segment.n_points+1)
+            n_targets = segment.n_points+1 if segment is segments[-1] else segment.n_points # The last segment also fills the final EEP
+            for j, key in enumerate(columns):
+                if key not in history.bulk_names:
+                    continue # Left as NaN
+                values = np.asarray(getattr(history, key)[rows], dtype=float)
+                out[eep:eep+n_targets, j] = np.interp(targets[:n_targets], distance, values)
+        eep += segment.n_points
+    return out
+
+
+
+# Resample every history in the grid and save the cube (plus eep_cube.json describing it) as path
+# If path can't be written (i.e. a read-only data folder), the cube is kept in memory instead
+def build_eep_cube(masses=None, path=None, columns=EEP_COLUMNS, segments=EEP_SEGMENTS):
+    catalog = load_data.get_catalog()
+    masses = catalog.masses() if masses is None else list(masses)
+    path = os.path.join(load_data.data_folder, CUBE_FILENAME) if path is None else path
+    segment_slices, primary_eeps, n_eep = _layout(segments)
+
+    try:
+        data = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=np.float64, shape=(len(masses), n_eep, len(columns)))
+    except OSError:
+        path = None
+        data = np.empty((len(masses), n_eep, len(columns)))
+
+    for i, M in enumerate(masses):
+        history = load_data.load_history(M, columns=columns)
+        data[i] = _resample_history(history, columns, segments)
+
+    meta = {
+        "cube_version": CUBE_VERSION,
+        "masses": masses,
+        "columns": list(columns),
+        "segments": [asdict(segment) for segment in segments],
+        "segment_slices": segment_slices,
+        "primary_eeps": primary_eeps,
+        "sources": {str(M): catalog.run(M).signature for M in masses}, # To tell if a history changed since the cube was built
+    }
+
+    if path is not None:
+        data.flush()
+        del data
+        os.replace(path + ".tmp", path)
+        with open(_meta_path(path) + ".tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(_meta_path(path) + ".tmp", _meta_path(path))
+        data = np.load(path, mmap_mode="r")
+
+    return EEPCube(data, masses, columns, primary_eeps, segment_slices)
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+
+# Load a saved cube, or None if there isn't one or it doesn't match the grid, columns, or segments anymore
+def load_eep_cube(path=None, columns=EEP_COLUMNS, segments=EEP_SEGMENTS):
+    path = os.path.join(load_data.data_folder, CUBE_FILENAME) if path is None else path
+    try:
+        with open(_meta_path(path)) as file:
+            meta = json.load(file)
+        data = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    catalog = load_data.get_catalog()
+    if meta.get("cube_version") != CUBE_VERSION or meta["columns"] != list(columns):
+        return None
+    if meta["segments"] != [asdict(segment) for segment in segments] or meta["masses"] != catalog.masses():
+        return None
+    if any(catalog.run(M).signature != meta["sources"][str(M)] for M in meta["masses"]):
+        return None
+    return EEPCube(data, meta["masses"], meta["columns"], meta["primary_eeps"], meta["segment_slices"])
+
+
+
+# The grid's EEP cube: loaded from data_folder if it's up to date, otherwise built (and saved) the first time it's needed
+_cube = None
+_cube_lock = threading.Lock()
+
+def get_eep_cube():
+    global _cube
+    with _cube_lock:
+        if _cube is None:
+            _cube = load_eep_cube()
+            if _cube is None:
+                _cube = build_eep_cube()
+        return _cube
+
+
+
+# Interpolated track for a mass between grid points, as a history-like object (a MesaColumns, like load_history returns),
+# so it can be passed to HRDiagram.add_path and the HistoryPlot functions.
+# Its rows are EEPs instead of models: model_number is the EEP index, EEPs the mass doesn't reach are dropped, and no profiles are available.
+# Event attributes (index_ZAMS, age_ZAMS, ...) are set for the events that are primary EEPs
+def interpolate_history(M, cube=None):
+    cube = get_eep_cube() if cube is None else cube
+    track = cube.interpolate(M)[0]
+    eeps = np.flatnonzero(~np.all(np.isnan(track), axis=1))
+
+    columns = {key: track[eeps, j] for j, key in enumerate(cube.columns)}
+    columns["model_number"] = eeps
+    history = load_data.MesaColumns(f"interpolated M={M}", columns, {"initial_mass": M}, list(columns))
+    history.model_numbers_available = np.array([], dtype=int)
+
+    events = {}
+    for event in evolutionary_events.EVENTS:
+        eep = cube.primary_eeps.get(event.name)
+        rows = np.flatnonzero(eeps == eep)
+        events[event.name] = int(rows[0]) if len(rows) > 0 else None
+    load_data._set_event_attributes(history, events)
+    return history
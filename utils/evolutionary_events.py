@@ -0,0 +1,165 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+
+
+
+# Define all evolutionary events (ZAMS, TAMS, etc) that can be located in a history
+# Each event is the first row in a history where its condition is True (and, if it has one, after its "after" event).
+# Conditions work on whole columns at once, so the same condition can be evaluated on one history or on many
+# histories stacked end to end (see find_events).
+
+@dataclass
+class EvolutionaryEvent:
+    """Represents an event in a star's evolution and how to find it in a history."""
+    name: str                       # Used in attribute names (e.g., "ZAMS" -> history.index_ZAMS, history.age_ZAMS)
+    label: str                      # The label for plots (e.g., "Zero Age Main Sequence")
+    columns: list                   # The history columns used by the condition (e.g., ["log_LH", "log_L"])
+    condition: Callable             # condition(cols, ref) -> boolean array that is True for every row where the event has occurred
+    after: Optional[str] = None     # Name of an earlier event that must happen first; ref holds the value of each column at that event
+
+
+
+EVENTS = [
+
+    # Hydrogen fusion supplies (nearly) all of the star's luminosity
+    EvolutionaryEvent(
+        name="ZAMS",
+        label="Zero Age Main Sequence",
+        columns=["log_LH", "log_L"],
+        condition=lambda cols, ref: cols["log_LH"] - cols["log_L"] > np.log10(0.999)),
+
+    # A helium core has formed
+    EvolutionaryEvent(
+        name="TAMS",
+        label="Terminal Age Main Sequence",
+        columns=["he_core_mass"],
+        condition=lambda cols, ref: cols["he_core_mass"] > 0),
+
+    # The central helium fraction starts dropping after TAMS, which indicates helium fusion has started
+    EvolutionaryEvent(
+        name="He_fusion",
+        label="Helium ignition",
+        columns=["center_he4", "star_age"],
+        condition=lambda cols, ref:
+            ((ref["center_he4"] - cols["center_he4"])/ref["center_he4"] > 0.0001) & (cols["star_age"] > ref["star_age"]),
+        after="TAMS"),
+
+    # Helium is used up in the core
+    EvolutionaryEvent(
+        name="He_exhaustion",
+        label="Core helium exhaustion",
+        columns=["center_he4"],
+        condition=lambda cols, ref: cols["center_he4"] < 1e-4,
+        after="He_fusion"),
+
+    # First helium shell flash: helium fusion briefly produces far more energy than the star radiates
+    EvolutionaryEvent(
+        name="TP_AGB",
+        label="Start of thermal pulses (AGB)",
+        columns=["log_LHe", "log_L"],
+        condition=lambda cols, ref: cols["log_LHe"] - cols["log_L"] > 1,
+        after="He_exhaustion"),
+
+    # Fusion has (nearly) stopped and the star has shrunk to white dwarf size
+    EvolutionaryEvent(
+        name="WD",
+        label="White dwarf",
+        columns=["log_LH", "log_LHe", "log_L", "log_R"],
+        condition=lambda cols, ref:
+            (10**cols["log_LH"] + 10**cols["log_LHe"] < 0.01 * 10**cols["log_L"]) & (cols["log_R"] < -1),
+        after="TAMS"),
+]
+
+EVENTS_BY_NAME = {event.name: event for event in EVENTS}
+
+
+
+
+
+# Get a column from a history as a float array, or all NaN if this history doesn't have it (so no event that uses it is found)
+# rows: only get these rows (i.e. slice(start, None) for the rows after start)
+def _get_column(history, key, rows=slice(None)):
+    try:
+        return np.asarray(getattr(history, key)[rows], dtype=float)
+    except (AttributeError, KeyError):
+        return np.full(len(history.star_age[rows]), np.nan)
+
+
+
+# Find every event in a list of histories.
+# All histories are stacked into one long array per column, so each event's condition is evaluated once for the whole list
+# (no loop over histories). Events are evaluated in list order, so an event's "after" event must come before it.
+# Returns a list with one dictionary per history: event name -> index in that history (None if the event was not found)
+def find_events(histories, events=EVENTS):
+
+    if len(histories) == 0:
+        return []
+
+    # Row bookkeeping: which history each row belongs to, and the row's index within that history
+    lengths = np.array([len(history.star_age) for history in histories])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(int)
+    track = np.repeat(np.arange(len(histories)), lengths)
+    row_in_track = np.arange(np.sum(lengths)) - np.repeat(starts, lengths)
+
+    # Stack every column used by any event
+    keys = list(dict.fromkeys(key for event in events for key in event.columns))
+    cols = {key: np.concatenate([_get_column(history, key) for history in histories]) for key in keys}
+
+    found = {} # Event name -> index of the event in each history (-1 if not found)
+    with np.errstate(all="ignore"):
+        for event in events:
+
+            # Value of each column at the earlier event, repeated for every row of that history
+            ref = {}
+            if event.after is not None:
+                after_per_row = found[event.after][track]
+                rows_at_after = starts[track] + np.maximum(after_per_row, 0)
+                ref = {key: cols[key][rows_at_after] for key in event.columns}
+
+            mask = event.condition(cols, ref)
+            if event.after is not None:
+                mask &= (after_per_row >= 0) & (row_in_track > after_per_row)
+
+            # First True row in each history
+            rows = np.flatnonzero(mask)
+            tracks_found, first = np.unique(track[rows], return_index=True)
+            found[event.name] = np.full(len(histories), -1)
+            found[event.name][tracks_found] = row_in_track[rows[first]]
+
+    return [
+        {event.name: (int(found[event.name][i]) if found[event.name][i] >= 0 else None) for event in events}
+        for i in range(len(histories))]
+
+
+
+# Find events in rows that were added to the end of a history (i.e. a MESA run that is still going), without checking the
+# earlier rows again. found: the events found before rows start onwards were added or changed (from find_events or an earlier
+# call to update_events). Events found at or after start are searched for again, since those rows may have been rewritten.
+# Returns a dictionary: event name -> index in the history (None if the event was not found)
+def update_events(history, found, start, events=EVENTS):
+    found = dict(found)
+    with np.errstate(all="ignore"):
+        for event in events:
+            if found.get(event.name) is not None and found[event.name] < start:
+                continue
+            found[event.name] = None
+
+            # Only rows from start onwards (and after the "after" event) can hold an event that wasn't found before
+            first = start
+            ref = {}
+            if event.after is not None:
+                i_after = found[event.after]
+                if i_after is None:
+                    continue
+                first = max(first, i_after+1)
+                ref = {key: _get_column(history, key, slice(i_after, i_after+1))[0] for key in event.columns}
+
+            cols = {key: _get_column(history, key, slice(first, None)) for key in event.columns}
+            rows = np.flatnonzero(event.condition(cols, ref))
+            if len(rows) > 0:
+                found[event.name] = first + int(rows[0])
+
+    return found
@@ -0,0 +1,109 @@
+import os
+import argparse
+
+import numpy as np
+
+import utils.load_data as load_data
+import utils.grid_bundle as grid_bundle
+import utils.evolutionary_events as evolutionary_events
+import utils.config.stellar_evolution_data as stellar_evolution_data
+
+
+
+# Pack the grid in load_data.data_folder into one bundle file (see grid_bundle) that the app can use from a web server,
+# i.e. when it's published to run in the browser: every history, the profiles the app shows (each substage's example model,
+# plus a few saved profiles on either side so stepping to neighbouring models works), and the events found in each history.
+# Floats are stored as float32 (except load_data.FLOAT64_COLUMNS) unless --float64 is given, which halves the bundle's size.
+# Example usage (from the repo folder):
+# python -m utils.export_bundle grid.bundle
+# python -m utils.export_bundle grid.bundle --data-folder "C:/.../MESA output files/" --neighbors 0
+# Then in the app: load_data.data_bundle = "https://.../grid.bundle"
+
+
+
+
+
+# Model numbers of the saved profiles the app can show for one mass: each substage example's profile (the same one
+# load_profile would load), and up to `neighbors` saved profiles before and after it
+def referenced_profiles(M, neighbors=2):
+    folder_index = load_data.get_folder_index(M)
+    model_numbers = folder_index.model_numbers
+    rows = set()
+    for substage in stellar_evolution_data.SUBSTAGES_LIST:
+        for model in substage.models:
+            if abs(model.mass - M) > 1e-6 or model.model_example is None:
+                continue
+            try:
+                modelnum = load_data._resolve_modelnum(folder_index, model.model_example)
+            except ValueError:
+                continue
+            i = int(np.searchsorted(model_numbers, modelnum))
+            rows.update(range(max(i-neighbors, 0), min(i+neighbors+1, len(model_numbers))))
+    return [int(model_numbers[i]) for i in sorted(rows)]
+
+
+
+# Every loaded column of a history/profile, as arrays to write
+def _bundle_columns(mesa_data, float32):
+    columns = {}
+    for name in mesa_data.bulk_names:
+        values = np.asarray(mesa_data.columns[name])
+        if float32 and values.dtype == np.float64 and name not in load_data.FLOAT64_COLUMNS:
+            values = values.astype(np.float32)
+        columns[name] = values
+    return columns
+
+
+
+# Write the bundle. masses: None for every mass in the grid. neighbors: see referenced_profiles. all_profiles: include every saved profile
+# history_columns/profile_columns: columns to include (None = all of them). Returns the size of the bundle in bytes
+def export_bundle(output_filepath, masses=None, neighbors=2, all_profiles=False, float32=True, history_columns=None, profile_columns=None):
+    if load_data.data_bundle is not None:
+        raise ValueError("load_data.data_bundle is set: bundles are exported from load_data.data_folder")
+    catalog = load_data.get_catalog()
+    masses = catalog.masses() if masses is None else list(masses)
+
+    runs = []
+    for M in masses:
+        history = load_data.load_history(M, columns=history_columns)
+        events = {}
+        for event in evolutionary_events.EVENTS:
+            index = getattr(history, f"index_{event.name}")
+            events[event.name] = None if np.isnan(index) else int(index)
+
+        if all_profiles:
+            model_numbers = [int(modelnum) for modelnum in load_data.get_folder_index(M).model_numbers]
+        else:
+            model_numbers = referenced_profiles(M, neighbors)
+        profiles = {}
+        for modelnum in model_numbers:
+            profile = load_data.load_profile(M, history, modelnum=modelnum, columns=profile_columns)
+            profiles[modelnum] = (_bundle_columns(profile, float32), profile.header_data)
+
+        runs.append({
+            "run": catalog.run(M),
+            "history": (_bundle_columns(history, float32), history.header_data),
+            "events": events,
+            "profiles": profiles,
+        })
+
+    grid_bundle.write_bundle(output_filepath, runs)
+    return os.path.getsize(output_filepath)
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the grid's histories, profiles, and events into one bundle file.")
+    parser.add_argument("output", help="Bundle file to write")
+    parser.add_argument("--data-folder", default=None, help="Grid folder (default: load_data.data_folder)")
+    parser.add_argument("--neighbors", type=int, default=2, help="Saved profiles to include on either side of each example model")
+    parser.add_argument("--all-profiles", action="store_true", help="Include every saved profile")
+    parser.add_argument("--float64", action="store_true", help="Store every float column as float64")
+    args = parser.parse_args()
+
+    if args.data_folder is not None:
+        load_data.data_folder = args.data_folder
+    size = export_bundle(args.output, neighbors=args.neighbors, all_profiles=args.all_profiles, float32=not args.float64)
+    print(f"Wrote {args.output} ({size/2**20:.1f} MB)")
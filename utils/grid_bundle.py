@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import struct
+import threading
+import weakref
+import urllib.request
+from dataclasses import asdict
+
+import numpy as np
+
+import utils.grid_catalog as grid_catalog
+
+
+
+# Single-file bundle of a whole grid (histories, the profiles the app uses, profile indexes, and precomputed evolutionary events),
+# so the app can run from one file on a web server (i.e. marimo in the browser) instead of a folder of hundreds of ASCII files.
+# Layout:
+#   preamble: 8 byte magic, version (uint32), reserved (uint32), length of the table of contents (uint64), little-endian
+#   table of contents: JSON. For each run: its grid_catalog.GridRun, the history's header and columns, the event indices,
+#                      and each profile's header and columns. Every column is {"offset", "dtype", "length"}
+#   data: every column as raw little-endian array bytes, each starting on a multiple of ALIGNMENT (offsets are from the data start)
+# Only the table of contents is read when a bundle is opened; columns are read by byte range when they're asked for
+# (seeks/memory maps for a local file, HTTP range requests for a URL), so nothing is downloaded until a plot needs it.
+# Bundles are made with utils/export_bundle.py. Set load_data.data_bundle to use one.
+# Example usage:
+# bundle = grid_bundle.open_bundle("https://.../grid.bundle")
+# bundle.masses()  # [0.2, 0.5, 1.0, 3.0]
+# columns, header_data, columns_in_file, events = bundle.folder_index(1.0).read_history(["log_Teff", "log_L"])
+MAGIC = b"MESABNDL"
+BUNDLE_VERSION = 1  # Bump this if the layout changes
+_PREAMBLE = struct.Struct("<8sIIQ")
+ALIGNMENT = 64
+FIRST_READ = 65536  # Bytes read when a bundle is opened (more are read if the table of contents is longer)
+MERGE_GAP = 65536   # Columns closer than this in the file are fetched with one request
+
+
+
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+
+# Write a bundle. runs: list of dictionaries with
+#   "run": grid_catalog.GridRun
+#   "history": (columns dict, header_data)
+#   "events": event name -> index in the history (None if not found)
+#   "profiles": model number -> (columns dict, header_data)
+def write_bundle(filepath, runs):
+    arrays = []
+
+    def add_columns(columns):
+        entries = {}
+        for name, values in columns.items():
+            values = np.asarray(values)
+            values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+            offset = _align(arrays[-1][0] + arrays[-1][1].nbytes) if len(arrays) > 0 else 0
+            arrays.append((offset, values))
+            entries[name] = {"offset": offset, "dtype": values.dtype.str, "length": len(values)}
+        return entries
+
+    def add_file(columns, header_data):
+        return {"header_data": header_data, "columns": add_columns(columns)}
+
+    toc = {"bundle_version": BUNDLE_VERSION, "runs": []}
+    for run in runs:
+        toc["runs"].append({
+            "run": asdict(run["run"]),
+            "history": add_file(*run["history"]),
+            "events": run["events"],
+            "profiles": {str(int(modelnum)): add_file(*profile) for modelnum, profile in run["profiles"].items()},
+        })
+
+    toc_bytes = json.dumps(toc).encode()
+    data_start = _align(_PREAMBLE.size + len(toc_bytes))
+    with open(filepath + ".tmp", "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, BUNDLE_VERSION, 0, len(toc_bytes)))
+        file.write(toc_bytes)
+        for offset, values in arrays:
+            file.write(b"\0" * (data_start + offset - file.tell()))
+            file.write(values.tobytes())
+    os.replace(filepath + ".tmp", filepath)
+
+
+
+
+
+# Byte ranges of a local bundle file. Columns are memory-mapped, so only the pages that are used get read
+class _FileRanges:
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, offset, length):
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
+    def read_arrays(self, entries, data_start):
+        return [np.memmap(self.path, dtype=entry["dtype"], mode="r", offset=data_start + entry["offset"], shape=(entry["length"],))
+                for entry in entries]
+
+
+
+# Byte ranges of a bundle on a web server, with HTTP range requests. If the server ignores ranges (and sends the whole
+# file), the whole file is kept so it's only downloaded once
+class _HTTPRanges:
+
+    def __init__(self, url):
+        self.url = url
+        self._whole_file = None
+
+    def read(self, offset, length):
+        if self._whole_file is not None:
+            return self._whole_file[offset:offset+length]
+        status, content = _http_get(self.url, offset, offset+length)
+        if status == 200:
+            self._whole_file = content
+            return content[offset:offset+length]
+        return content
+
+    # Nearby columns are fetched together, so loading a history's columns takes a few requests instead of one per column
+    def read_arrays(self, entries, data_start):
+        spans = sorted(
+            (data_start + entry["offset"], data_start + entry["offset"] + entry["length"]*np.dtype(entry["dtype"]).itemsize, i)
+            for i, entry in enumerate(entries))
+        arrays = [None] * len(entries)
+        while len(spans) > 0:
+            group = [spans.pop(0)]
+            while len(spans) > 0 and spans[0][0] - group[-1][1] < MERGE_GAP:
+                group.append(spans.pop(0))
+            start = group[0][0]
+            content = self.read(start, max(end for _, end, _ in group) - start)
+            for span_start, span_end, i in group:
+                arrays[i] = np.frombuffer(content[span_start-start:span_end-start], dtype=entries[i]["dtype"])
+        return arrays
+
+
+
+# GET bytes [start, end) of url. Returns the HTTP status and the content
+# In the browser (Pyodide, sys.platform == "emscripten") there are no sockets, so a synchronous XMLHttpRequest is used instead
+def _http_get(url, start, end):
+    if sys.platform == "emscripten":
+        import js
+        request = js.XMLHttpRequest.new()
+        request.open("GET", url, False)
+        request.responseType = "arraybuffer"
+        request.setRequestHeader("Range", f"bytes={start}-{end-1}")
+        request.send(None)
+        return request.status, bytes(js.Uint8Array.new(request.response).to_py())
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end-1}"})
+    with urllib.request.urlopen(request) as response:
+        return response.status, response.read()
+
+
+
+
+
+# One run in a bundle. Stands in for load_data.MesaFolderIndex: model_numbers are the profiles in the bundle
+class BundleRunIndex:
+
+    def __init__(self, bundle, entry):
+        self.bundle = bundle
+        self.entry = entry
+        self.name = f"{bundle.source}#M={entry['run']['mass']}"
+        self.model_numbers = np.array(sorted(int(modelnum) for modelnum in entry["profiles"]), dtype=int)
+        self.profile_ages = None
+        self._history_ref = None
+
+    def is_stale(self):
+        return False
+
+    def get_history(self):
+        if self._history_ref is None:
+            return None
+        return self._history_ref()
+
+    def set_history(self, history):
+        self._history_ref = weakref.ref(history)
+
+    # names: column names to read (None = every column in the bundle)
+    def _read_file(self, file_entry, names):
+        names = list(file_entry["columns"]) if names is None else [name for name in names if name in file_entry["columns"]]
+        arrays = self.bundle._ranges.read_arrays([file_entry["columns"][name] for name in names], self.bundle.data_start)
+        return dict(zip(names, arrays)), file_entry["header_data"], list(file_entry["columns"])
+
+    # Returns the columns, header data, every column in the bundle (so it's known what else could be loaded), and the event indices
+    def read_history(self, names=None):
+        return self._read_file(self.entry["history"], names) + (self.entry["events"],)
+
+    # Returns the columns, header data, and every column in the bundle
+    def read_profile(self, modelnum, names=None):
+        return self._read_file(self.entry["profiles"][str(int(modelnum))], names)
+
+
+
+# An opened bundle. Also has the same masses()/run() as grid_catalog.GridCatalog, so it can stand in for data_folder's catalog
+class GridBundle:
+
+    def __init__(self, source):
+        self.source = source
+        self._ranges = _HTTPRanges(source) if source.startswith(("http://", "https://")) else _FileRanges(source)
+
+        head = self._ranges.read(0, FIRST_READ)
+        magic, version, _, toc_length = _PREAMBLE.unpack_from(head)
+        if magic != MAGIC:
+            raise ValueError(f"{source} is not a grid bundle")
+        if version != BUNDLE_VERSION:
+            raise ValueError(f"{source} is a version {version} bundle, but version {BUNDLE_VERSION} is needed")
+        toc_end = _PREAMBLE.size + toc_length
+        if toc_end > len(head):
+            head += self._ranges.read(len(head), toc_end - len(head))
+        toc = json.loads(head[_PREAMBLE.size:toc_end])
+
+        self.data_start = _align(toc_end)
+        self.runs = [grid_catalog.GridRun(**entry["run"]) for entry in toc["runs"]]
+        self._indices = [BundleRunIndex(self, entry) for entry in toc["runs"]]
+
+    def masses(self):
+        return sorted({run.mass for run in self.runs if run.mass is not None})
+
+    def _find(self, M):
+        i = next((i for i, run in enumerate(self.runs) if run.mass is not None and abs(run.mass - M) < 1e-6), None)
+        if i is None:
+            raise KeyError(f"No MESA run with M={M} in {self.source}")
+        return i
+
+    def run(self, M):
+        return self.runs[self._find(M)]
+
+    def folder_index(self, M):
+        return self._indices[self._find(M)]
+
+
+
+# Process-wide opened bundles, keyed by source
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+def open_bundle(source):
+    with _bundles_lock:
+        if source not in _bundles:
+            _bundles[source] = GridBundle(source)
+        return _bundles[source]
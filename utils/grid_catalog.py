@@ -0,0 +1,295 @@
+import os
+import re
+import ast
+import json
+import warnings
+import threading
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+import utils.lazy_import as lazy_import
+
+mr = lazy_import.lazy_module("mesa_reader") # Imports pandas, so only imported once a profiles.index has to be read
+
+
+
+# Catalog of every MESA run folder in one or more grid roots, saved as a single JSON manifest so the app doesn't have to
+# list directories or parse headers/profiles.index files at startup.
+# The manifest is written to <root>/grid_manifest.json (or manifest_path, if there are several roots) the first time a
+# root is scanned, and reused after that. A run is rescanned if its history or profiles.index file changes, and the roots
+# are rescanned if a mass is asked for that isn't in the manifest (i.e. a new run was copied in).
+# Example usage:
+# catalog = grid_catalog.get_catalog(["C:/.../MESA output files/"])
+# catalog.masses()   # [0.2, 0.5, 1.0, ...]
+# catalog.run(1.0)   # GridRun for the "M=1.0" folder
+MANIFEST_FILENAME = "grid_manifest.json"
+MANIFEST_VERSION = 1  # Bump this if the layout of GridRun changes, so old manifests get rebuilt
+
+HISTORY_FILES = ["trimmed_history.data", "history.data"]  # In order of preference, if a folder has both
+INDEX_FILE = "profiles.index"
+
+
+
+
+
+@dataclass
+class GridRun:
+    """Everything the loaders need to know about one MESA run folder, without opening any of its data files."""
+    folder: str                     # Path of the run folder, relative to the manifest's folder if possible
+    mass: float                     # Initial mass in M_sun, from the folder name ("M=1.0") or else the history header (initial_mass)
+    history_file: str               # Name of the history file in the folder (i.e. "trimmed_history.data")
+    model_number_min: int           # First and last model numbers in the history
+    model_number_max: int
+    profile_count: int              # Number of saved profiles
+    profile_model_numbers: list     # Model number of each saved profile (sorted), and the number of its profileN.data file
+    profile_numbers: list
+    history_columns: list           # Column names in the history file, and in the profile files (from the first profile)
+    profile_columns: list
+    file_sizes: dict                # File name -> size in bytes, for the history, profiles.index, and every profile
+    signature: list                 # [size, mtime_ns] of the history and of profiles.index, to tell if the run has changed since
+
+
+
+@dataclass
+class GridCatalog:
+    """All the runs found in a list of grid roots, and the manifest file they're saved in."""
+    roots: list
+    manifest_path: str
+    runs: list
+
+    # Absolute path of a run's folder
+    def folder_path(self, run):
+        return os.path.normpath(os.path.join(os.path.dirname(self.manifest_path), run.folder))
+
+    def masses(self):
+        return sorted({run.mass for run in self.runs if run.mass is not None})
+
+    # The run with initial mass M. Rescans the roots once if there isn't one, in case it was added after the manifest was written
+    def run(self, M):
+        run = self._find(M)
+        if run is None:
+            self.runs = _scan_roots(self.roots, self.manifest_path)
+            _write_manifest(self)
+            run = self._find(M)
+        if run is None:
+            raise KeyError(f"No MESA run with M={M} found in {self.roots}")
+        return run
+
+    def _find(self, M):
+        return next((run for run in self.runs if run.mass is not None and abs(run.mass - M) < 1e-6), None)
+
+    # Rescan one run whose files changed since the manifest was written, and save the updated manifest
+    def refresh(self, run):
+        new_run = _scan_run(self.folder_path(run), self.manifest_path)
+        runs = [r for r in self.runs if r is not run]
+        if new_run is not None:
+            runs.append(new_run)
+        self.runs = sorted(runs, key=_run_sort_key)
+        _write_manifest(self)
+        return new_run
+
+
+
+
+
+# [size, mtime_ns] of a file, to tell if it has changed. Used for every file signature (the manifest, load_data's binary cache
+# and folder indices), always as a list, so a signature compares equal to the same signature read back from a JSON file
+def file_signature(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def run_signature(folder_path, history_file):
+    return file_signature(os.path.join(folder_path, history_file)) + file_signature(os.path.join(folder_path, INDEX_FILE))
+
+
+
+# Read the header of a MESA history/profile file. Standard MESA layout:
+# line 2: header names, line 3: header values, line 6: column names, line 7 onwards: one row of data per line
+def read_mesa_header(filepath):
+    with open(filepath) as file:
+        lines = [file.readline() for _ in range(6)]
+
+    header_names = lines[1].split()
+    header_data = {}
+    for name, value in zip(header_names, lines[2].split()):
+        try:
+            header_data[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            header_data[name] = value
+    bulk_names = lines[5].split()
+    return bulk_names, header_names, header_data
+
+
+
+# First and last model numbers in a history, from its first data row and last line (without reading the rest of the file)
+# Raises IndexError if the history has no data rows yet (i.e. a run that was just started)
+def _model_number_range(filepath, bulk_names):
+    col = bulk_names.index("model_number")
+    with open(filepath, "rb") as file:
+        for _ in range(6):
+            file.readline()
+        first_row = file.readline().split()
+        file.seek(0, os.SEEK_END)
+        file.seek(max(file.tell() - 65536, 0))
+        last_row = file.read().splitlines()[-1].split()
+    return int(first_row[col]), int(last_row[col])
+
+
+
+# Catalog entry for one folder, or None if it isn't a MESA run folder (needs a history file and profiles.index)
+# A run whose history or profiles.index has no rows yet (or can't be parsed) is skipped with a warning instead of stopping the
+# whole scan. It's picked up by a later scan (i.e. when a mass that isn't in the catalog is asked for) once it has data
+def _scan_run(folder_path, manifest_path):
+    history_file = next((name for name in HISTORY_FILES if os.path.isfile(os.path.join(folder_path, name))), None)
+    if history_file is None or not os.path.isfile(os.path.join(folder_path, INDEX_FILE)):
+        return None
+    history_filepath = os.path.join(folder_path, history_file)
+
+    signature = run_signature(folder_path, history_file)
+    history_columns, _, history_header = read_mesa_header(history_filepath)
+    try:
+        model_number_min, model_number_max = _model_number_range(history_filepath, history_columns)
+        profiles_index = mr.MesaProfileIndex(os.path.join(folder_path, INDEX_FILE))
+    except (IndexError, ValueError) as error:  # ValueError: also pandas' EmptyDataError, for a profiles.index without profiles
+        warnings.warn(f"Skipping MESA run {folder_path}: its {history_file} or {INDEX_FILE} has no data yet ({error!r})")
+        return None
+    profile_model_numbers = [int(modelnum) for modelnum in profiles_index.model_numbers]
+    profile_numbers = [int(profile_number) for profile_number in profiles_index.profile_numbers]
+
+    file_sizes = {history_file: signature[0], INDEX_FILE: signature[2]}
+    for profile_number in profile_numbers:
+        filename = f"profile{profile_number}.data"
+        if os.path.isfile(os.path.join(folder_path, filename)):
+            file_sizes[filename] = os.path.getsize(os.path.join(folder_path, filename))
+
+    profile_columns = []
+    if len(profile_numbers) > 0 and f"profile{profile_numbers[0]}.data" in file_sizes:
+        profile_columns, _, _ = read_mesa_header(os.path.join(folder_path, f"profile{profile_numbers[0]}.data"))
+
+    # Mass from the folder name (i.e. "M=1.0"), otherwise from the history header
+    match = re.search(r"M=(\d+(?:\.\d*)?)", os.path.basename(os.path.normpath(folder_path)))
+    if match is not None:
+        mass = float(match.group(1))
+    elif isinstance(history_header.get("initial_mass"), (int, float)):
+        mass = float(history_header["initial_mass"])
+    else:
+        mass = None
+
+    # Relative paths keep the manifest valid if the whole grid is copied somewhere else
+    try:
+        folder = os.path.relpath(folder_path, os.path.dirname(manifest_path))
+    except ValueError: # i.e. on a different drive on Windows
+        folder = os.path.abspath(folder_path)
+
+    return GridRun(
+        folder=folder,
+        mass=mass,
+        history_file=history_file,
+        model_number_min=model_number_min,
+        model_number_max=model_number_max,
+        profile_count=len(profile_numbers),
+        profile_model_numbers=profile_model_numbers,
+        profile_numbers=profile_numbers,
+        history_columns=history_columns,
+        profile_columns=profile_columns,
+        file_sizes=file_sizes,
+        signature=signature)
+
+
+
+# Every run folder anywhere under the roots (hidden folders like .npy_cache are skipped)
+def _scan_roots(roots, manifest_path):
+    runs = []
+    for root in roots:
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+            run = _scan_run(dirpath, manifest_path)
+            if run is not None:
+                runs.append(run)
+                dirnames[:] = [] # Runs aren't nested inside other runs
+    return sorted(runs, key=_run_sort_key)
+
+# By mass, with runs of unknown mass last
+def _run_sort_key(run):
+    return (run.mass is None, run.mass or 0, run.folder)
+
+
+
+
+
+# Save the manifest atomically, so a half-written manifest is never read. A read-only grid just isn't saved
+def _write_manifest(catalog):
+    manifest = {
+        "manifest_version": MANIFEST_VERSION,
+        "roots": [os.path.normpath(root) for root in catalog.roots],
+        "runs": [asdict(run) for run in catalog.runs],
+    }
+    try:
+        with open(catalog.manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(catalog.manifest_path + ".tmp", catalog.manifest_path)
+    except OSError:
+        pass
+
+
+
+# The saved catalog, or None if there isn't one (or it's out of date or for different roots)
+def _read_manifest(roots, manifest_path):
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("manifest_version") != MANIFEST_VERSION:
+        return None
+    if manifest["roots"] != [os.path.normpath(root) for root in roots]:
+        return None
+    return GridCatalog(roots=list(roots), manifest_path=manifest_path, runs=[GridRun(**run) for run in manifest["runs"]])
+
+
+
+# Scan the roots and write a new manifest
+def build_catalog(roots, manifest_path=None):
+    roots = [roots] if isinstance(roots, str) else list(roots)
+    if manifest_path is None:
+        manifest_path = _default_manifest_path(roots)
+    catalog = GridCatalog(roots=roots, manifest_path=manifest_path, runs=_scan_roots(roots, manifest_path))
+    _write_manifest(catalog)
+    return catalog
+
+def _default_manifest_path(roots):
+    if len(roots) != 1:
+        raise ValueError("manifest_path must be given when there is more than one grid root")
+    return os.path.join(roots[0], MANIFEST_FILENAME)
+
+
+
+
+
+# Process-wide catalogs, keyed by manifest path
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+
+# Get the catalog for a list of grid roots (or a single root): read from the manifest if there is one, otherwise built by scanning
+# rebuild=True: ignore the saved manifest and scan again
+def get_catalog(roots, manifest_path=None, rebuild=False):
+    roots = [roots] if isinstance(roots, str) else list(roots)
+    if manifest_path is None:
+        manifest_path = _default_manifest_path(roots)
+    with _catalogs_lock:
+        catalog = _catalogs.get(manifest_path)
+        if catalog is None or catalog.roots != roots or rebuild:
+            catalog = None if rebuild else _read_manifest(roots, manifest_path)
+            if catalog is None:
+                catalog = build_catalog(roots, manifest_path)
+            _catalogs[manifest_path] = catalog
+    return catalog
+
+
+
+# Profile model numbers and profile file numbers of a run, as arrays (same as mr.MesaProfileIndex.model_numbers/profile_numbers)
+def profile_index_arrays(run):
+    return np.array(run.profile_model_numbers, dtype=int), np.array(run.profile_numbers, dtype=int)
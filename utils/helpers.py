@@ -28,4 +28,11 @@ def mass_luminosity_relation(M):
         L_predicted = 1.4 * M**3.5 
     if M>=55: 
         L_predicted = 32000 * M 
-    return L_predicted 
\ No newline at end of file
+    return L_predicted 
+
+
+# Row of a history that holds each model number (histories decimated by utils/trim_history.py don't have every model, 
+# so the row isn't always modelnum-1). Model numbers that aren't in the history get the next row that is. 
+def model_rows(history, model_numbers): 
+    rows = np.searchsorted(history.model_number, model_numbers) 
+    return np.minimum(rows, len(history.model_number)-1) 
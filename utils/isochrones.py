@@ -0,0 +1,94 @@
+import weakref
+from dataclasses import dataclass
+
+import numpy as np
+
+import utils.eep_cube as eep_cube
+
+
+
+# Isochrones (where stars of every mass are at one age, i.e. a star cluster) from the grid's EEP cube.
+# The grid's tracks are first interpolated onto a fine set of masses (eep_cube.EEPCube.interpolate). At each EEP, age
+# decreases with mass (heavier stars get there sooner), so the isochrone's point at that EEP is where the age crosses the
+# requested age between two neighbouring masses. Going through the EEPs in order traces the isochrone from the lowest mass
+# on the main sequence up to the most evolved stars.
+# Every age in a batch and every EEP is done at once with array operations; the fine age-EEP table is computed once per cube.
+# Example usage:
+# iso = isochrones.isochrone(1e9)
+# hr.ax.plot(10**iso.log_Teff, 10**iso.log_L)
+# isos = isochrones.isochrones([1e8, 1e9, 1e10])  # one Isochrone per age
+N_MASSES = 400  # Number of masses (log spaced between the lowest and highest grid mass) the tracks are interpolated to
+ISOCHRONE_COLUMNS = ["log_Teff", "log_L", "log_R"]  # Columns interpolated onto each isochrone
+
+
+
+
+
+@dataclass
+class Isochrone:
+    """Points of an isochrone, in order of EEP (EEPs no mass is at for this age are left out)."""
+    age: float                  # years
+    eep: np.ndarray             # EEP of each point
+    initial_mass: np.ndarray    # M_sun
+    log_Teff: np.ndarray
+    log_L: np.ndarray
+    log_R: np.ndarray
+
+
+
+
+
+# Fine age-EEP tables, computed once per cube: cube -> {n_masses: (masses, log10(star_age), tracks)}
+# tracks only has ISOCHRONE_COLUMNS (in that order), not every column of the cube, so the table stays a few MB
+_tables = weakref.WeakKeyDictionary()
+
+def _age_table(cube, n_masses):
+    tables = _tables.setdefault(cube, {})
+    if n_masses not in tables:
+        masses = np.geomspace(cube.masses[0], cube.masses[-1], n_masses)
+        tracks = cube.interpolate(masses, columns=ISOCHRONE_COLUMNS + ["star_age"])
+        log_age = np.log10(np.maximum(tracks[:, :, -1], 1.0))
+        tables[n_masses] = (masses, log_age, tracks[:, :, :-1])
+    return tables[n_masses]
+
+
+
+# Isochrones for a batch of ages (years), all computed at once. Returns a list of Isochrone, one per age
+def isochrones(ages, cube=None, n_masses=N_MASSES):
+    cube = eep_cube.get_eep_cube() if cube is None else cube
+    masses, log_age, tracks = _age_table(cube, n_masses)
+    ages = np.atleast_1d(np.asarray(ages, dtype=float))
+    log_t = np.log10(ages)[:, None, None]
+
+    # Where the age at each EEP crosses each requested age between neighbouring masses: (n_ages, n_masses-1, n_eep)
+    a0, a1 = log_age[:-1], log_age[1:]
+    crosses = ((a0 - log_t) * (a1 - log_t) <= 0) & (a0 != a1)
+
+    # First crossing at each EEP, and how far between the two masses it is
+    found = np.any(crosses, axis=1)
+    i = np.argmax(crosses, axis=1)
+    eeps = np.arange(log_age.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):  # Where nothing crosses, a0 == a1 (the result is masked out below)
+        frac = (log_t[:, :, 0] - a0[i, eeps]) / (a1[i, eeps] - a0[i, eeps])
+    frac = np.where(found, frac, np.nan)
+
+    def at_crossing(values):
+        return values[i, eeps]*(1-frac) + values[i+1, eeps]*frac
+
+    columns = {key: at_crossing(tracks[:, :, j]) for j, key in enumerate(ISOCHRONE_COLUMNS)}
+    log_mass = at_crossing(np.broadcast_to(np.log10(masses)[:, None], log_age.shape))
+
+    result = []
+    for k, age in enumerate(ages):
+        keep = found[k] & ~np.isnan(columns["log_Teff"][k]) & ~np.isnan(columns["log_L"][k])
+        result.append(Isochrone(
+            age=float(age),
+            eep=eeps[keep],
+            initial_mass=10**log_mass[k, keep],
+            **{key: columns[key][k, keep] for key in ISOCHRONE_COLUMNS}))
+    return result
+
+
+
+def isochrone(age, cube=None, n_masses=N_MASSES):
+    return isochrones([age], cube, n_masses)[0]
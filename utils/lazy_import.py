@@ -0,0 +1,41 @@
+import importlib
+import types
+
+
+
+# Deferred imports, so importing a module doesn't import its heavy dependencies (matplotlib, pandas through mesa_reader,
+# marimo) until something actually uses them. See utils/startup_report.py for what each import costs.
+# Example usage:
+# mr = lazy_import.lazy_module("mesa_reader")  # nothing is imported yet
+# mr.MesaProfileIndex(path)                    # mesa_reader is imported here, the first time it's used
+# plot_func = lazy_import.deferred_function("utils.plotting.history_plotting", "HistoryPlot.radius")
+
+
+
+
+
+# Stand-in for a module: the module is imported the first time one of its attributes is used
+class LazyModule(types.ModuleType):
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+
+# Stand-in for a function in another module (qualname can be nested, i.e. "HistoryPlot.radius"):
+# the module is imported the first time the function is called
+def deferred_function(module_name, qualname):
+
+    def call(*args, **kwargs):
+        func = importlib.import_module(module_name)
+        for attr in qualname.split("."):
+            func = getattr(func, attr)
+        return func(*args, **kwargs)
+
+    call.__name__ = qualname.split(".")[-1]
+    call.__qualname__ = qualname
+    call.__module__ = module_name
+    return call
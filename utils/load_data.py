@@ -1,81 +1,742 @@
-import mesa_reader as mr 
-import numpy as np 
+import os
+import re
+import itertools
+import json
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections.abc import Mapping
 
+import numpy as np
 
+import utils.helpers as helpers
+import utils.evolutionary_events as evolutionary_events
+import utils.grid_catalog as grid_catalog
+import utils.grid_bundle as grid_bundle
+import utils.lazy_import as lazy_import
 
-data_folder = "C:/Users/johnm/Local Desktop/Gayley/MESA output files/" 
+mr = lazy_import.lazy_module("mesa_reader") # Imports pandas, so only imported once a profiles.index has to be read
 
 
 
+data_folder = "C:/Users/johnm/Local Desktop/Gayley/MESA output files/"
 
+# Set data_bundle to a grid bundle (a file path or URL, made by utils/export_bundle.py) to load the grid from that one file
+# instead of data_folder, i.e. when the app runs in a browser. Only the columns and profiles that are used get read from it
+data_bundle = None
 
-def load_history(M, MESA_folder_path=None): 
+def get_bundle():
+    return grid_bundle.open_bundle(data_bundle)
+
+# Run folders in data_folder are found through its manifest (see grid_catalog), not by building "M=..." folder names
+# With a data_bundle, the bundle's runs are used instead
+def get_catalog():
+    if data_bundle is not None:
+        return get_bundle()
+    return grid_catalog.get_catalog(data_folder)
+
+# Binary cache: the first time a MESA output file is parsed, each column is saved as its own .npy file in a
+# hidden folder next to it (i.e. "M=1.0/.npy_cache/trimmed_history.data/"). Later loads memory-map those files
+# instead of re-parsing the ASCII file. Set use_binary_cache = False to always parse the original file.
+use_binary_cache = True
+cache_folder_name = ".npy_cache"
+CACHE_VERSION = 2   # Bump this if the layout of the cache folder changes, so old caches get rebuilt
+EVENTS_VERSION = 2  # Bump this if evolutionary_events.EVENTS changes, so cached event indices get recomputed
+
+# Set use_float32 = True to keep loaded columns as float32 instead of float64, which halves their memory (~7 significant digits is
+# plenty for plotting). The columns in FLOAT64_COLUMNS are always kept exact, since they're used to look up models by age/number.
+# The binary cache always stores float64, so this can be switched at any time.
+use_float32 = False
+FLOAT64_COLUMNS = ["model_number", "star_age"]
+
+
+
+
+
+# Dictionary-like container of columns saved in a cache folder. Each column is only memory-mapped the first time it is accessed.
+# files: column name -> .npy file name in cache_path. loaded: columns that are already in memory (i.e. just parsed and not cached).
+# float32: convert float columns (except FLOAT64_COLUMNS) to float32 as they're accessed, see use_float32
+class _LazyColumns(Mapping):
+
+    def __init__(self, cache_path, files, loaded=None, float32=False):
+        self.cache_path = cache_path
+        self.files = dict(files)
+        self.float32 = float32
+        self.loaded = {name: self._convert(name, values) for name, values in (loaded or {}).items()}
+
+    def _convert(self, name, values):
+        if self.float32 and values.dtype == np.float64 and name not in FLOAT64_COLUMNS:
+            return values.astype(np.float32)
+        return values
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = self._convert(name, np.load(os.path.join(self.cache_path, self.files[name]), mmap_mode="r"))
+        return self.loaded[name]
+
+    # Checking whether a column exists shouldn't load it
+    def __contains__(self, name):
+        return name in self.files or name in self.loaded
+
+    def __iter__(self):
+        return iter(dict.fromkeys(list(self.files) + list(self.loaded)))
+
+    def __len__(self):
+        return len(set(self.files) | set(self.loaded))
+
+
+
+
+
+# Folder that holds the cached columns of one MESA output file
+def _cache_path(filepath):
+    folder, filename = os.path.split(filepath)
+    return os.path.join(folder, cache_folder_name, filename)
+
+
+
+# Size and modification time (grid_catalog.file_signature) are cheap to check, so they are compared first.
+# The content hash is only computed when they disagree (i.e. the file was copied or touched but not changed).
+def _file_hash(filepath):
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+
+# Write meta.json last and atomically, so a half-written cache folder is never mistaken for a valid one
+def _write_cache_meta(cache_path, meta):
+    meta_path = os.path.join(cache_path, "meta.json")
+    with open(meta_path + ".tmp", "w") as file:
+        json.dump(meta, file)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+
+# Returns the cache's meta dictionary if the cache exists and matches the current file, otherwise None
+def _read_cache_meta(filepath):
+    cache_path = _cache_path(filepath)
+    try:
+        with open(os.path.join(cache_path, "meta.json")) as file:
+            meta = json.load(file)
+        size, mtime_ns = grid_catalog.file_signature(filepath)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("cache_version") != CACHE_VERSION or meta["size"] != size:
+        return None
+
+    if meta["mtime_ns"] != mtime_ns:
+        if meta["hash"] != _file_hash(filepath):
+            return None
+        # Same contents, new timestamp: remember the new timestamp so the hash doesn't need to be recomputed next time
+        meta["mtime_ns"] = mtime_ns
+        try:
+            _write_cache_meta(cache_path, meta)
+        except OSError:
+            pass
+
+    return meta
+
+
+
+# Save newly parsed columns to the cache and return the cache's updated meta dictionary.
+# Columns are added to the cache as they are needed, so meta["cached"] may only be some of meta["bulk_names"].
+# If the data folder is read-only, silently skip caching (returns None): the file will just be parsed again next time.
+def _write_cache(filepath, meta, parsed_columns):
+    cache_path = _cache_path(filepath)
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        if len(meta["cached"]) == 0 and os.path.exists(os.path.join(cache_path, "meta.json")):
+            os.remove(os.path.join(cache_path, "meta.json"))
+
+        for name, values in parsed_columns.items():
+            np.save(os.path.join(cache_path, _column_filename(meta, name)), np.ascontiguousarray(values))
+
+        meta = dict(meta, cached=list(dict.fromkeys(meta["cached"] + list(parsed_columns))))
+        _write_cache_meta(cache_path, meta)
+        return meta
+
+    except (OSError, TypeError):
+        return None
+
+def _column_filename(meta, name):
+    return f"{meta['bulk_names'].index(name)}.npy"
+
+
+
+
+
+# Parse only some columns of a MESA file (np.loadtxt with usecols skips converting every other column).
+# Columns whose values are written as integers (model_number, zone, ...) are returned as integers, like mesa_reader does.
+# For history files, rows from backups and restarts are removed the same way as mesa_reader's MesaData.remove_backups.
+def _read_mesa_columns(filepath, bulk_names, names):
+    with open(filepath) as file:
+        for _ in range(6):
+            file.readline()
+        return _remove_backups(_parse_mesa_rows(file, bulk_names, names))
+
+
+
+# Parse rows of data from a MESA file (any iterable of lines, i.e. a file positioned after the header) into a dictionary of columns
+def _parse_mesa_rows(lines, bulk_names, names):
+    names = list(dict.fromkeys(names))
+    if "model_number" in bulk_names and "model_number" not in names:
+        names.append("model_number")
+    usecols = [bulk_names.index(name) for name in names]
+
+    lines = iter(lines)
+    first_line = next(lines, "")
+    first_row = first_line.split()
+    if len(first_row) == 0:
+        return {name: np.empty(0) for name in names}
+    data = np.loadtxt(itertools.chain([first_line], lines), usecols=usecols, ndmin=2)
+
+    # Copy each column out of the 2D array, so every column is contiguous and the 2D array can be freed
+    columns = {}
+    for i, (name, col) in enumerate(zip(names, usecols)):
+        is_int = col < len(first_row) and re.fullmatch(r"[+-]?\d+", first_row[col]) is not None
+        columns[name] = data[:, i].astype(np.int64) if is_int else np.ascontiguousarray(data[:, i])
+    return columns
+
+
+
+# Remove rows that were later redone (after a backup or restart, MESA writes rows again starting from an earlier model number), 
+# keeping the last row written for each model number 
+def _remove_backups(columns):
+    if "model_number" in columns:
+        keep = _backup_mask(columns["model_number"])
+        if not np.all(keep):
+            columns = {name: values[keep] for name, values in columns.items()}
+    return columns
+
+# True for each row that is kept by _remove_backups
+def _backup_mask(model_number):
+    suffix_min = np.minimum.accumulate(model_number[::-1])[::-1]
+    keep = np.ones(len(model_number), dtype=bool)
+    keep[:-1] = model_number[:-1] < suffix_min[1:]
+    return keep
+
+
+
+# Names of the file's columns that are needed for a list of keys. Follows mesa_reader's naming fallbacks: the key itself, then
+# the key with a log_/log/lg_/lg/ln_/ln prefix, then the key without its log prefix. So i.e. asking for "P" finds "logP" and
+# "Teff" finds "log_Teff" if the file only has the log, and "log_R" finds "R" if the file only has the linear value.
+# Names are only matched through these prefixes ("pressure" doesn't find "logP").
+# Keys that don't match any column are skipped (accessing them later raises an AttributeError as usual).
+def _match_columns(keys, bulk_names):
+    matched = []
+    for key in keys:
+        candidates = [key] + [prefix + key for prefix in ["log_", "log", "lg_", "lg", "ln_", "ln"]]
+        match = re.match(r"^(?:lo?g_?|ln_?)(.+)", key)
+        if match is not None:
+            candidates.append(match.group(1))
+        matched += [name for name in candidates if name in bulk_names][:1]
+    return list(dict.fromkeys(matched))
+
+
+
+# Keys from a list of columns that could be read from the file but aren't in mesa_data yet
+def _missing_columns(mesa_data, columns):
+    if columns is None:
+        return [name for name in mesa_data.columns_in_file if name not in mesa_data.bulk_names]
+    return [name for name in _match_columns(columns, mesa_data.columns_in_file) if name not in mesa_data.bulk_names]
+
+
+
+# Slim replacement for mr.MesaData, used for every history and profile loaded here.
+# Holds a dictionary of columns (column name -> 1D array) and the header values, and nothing else: with __slots__ there is no
+# per-object __dict__. Attribute access works like MesaData (history.star_age, profile.h1, header values, and fallbacks like
+# profile.P = 10**profile.logP), so the plotting functions work with either one.
+# Any other attribute set on it (history.index_ZAMS, profile.modelnum, ...) is kept in the `extra` dictionary.
+class MesaColumns:
+    __slots__ = ("file_name", "columns", "header_data", "columns_in_file", "extra", "__weakref__")
+
+    def __init__(self, file_name, columns, header_data, columns_in_file):
+        self.file_name = file_name
+        self.columns = columns
+        self.header_data = header_data
+        self.columns_in_file = tuple(columns_in_file) # Every column in the file, including ones that weren't loaded
+        self.extra = {}
+
+    def __setattr__(self, name, value):
+        if name in MesaColumns.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self.extra[name] = value
+
+    # Only called for names that aren't slots or methods 
+    def __getattr__(self, name):
+        if name in MesaColumns.__slots__:
+            raise AttributeError(name)
+        if name in self.extra:
+            return self.extra[name]
+        try:
+            return self.data(name)
+        except KeyError:
+            pass
+        if name in self.header_data:
+            return self.header_data[name]
+        raise AttributeError(name)
+
+    @property
+    def bulk_names(self):
+        return tuple(self.columns)
+
+    # Same lookup order as MesaData.data: the column itself, then 10**log/exp(ln) of it, then log10/ln of the linear column
+    def data(self, key):
+        columns = self.columns
+        if key in columns:
+            return columns[key]
+        for prefix in ["log_", "log", "lg_", "lg"]:
+            if prefix + key in columns:
+                return 10**columns[prefix + key]
+        for prefix in ["ln_", "ln"]:
+            if prefix + key in columns:
+                return np.exp(columns[prefix + key])
+        match = re.match(r"^lo?g_?(.+)", key)
+        if match is not None and match.group(1) in columns:
+            return np.log10(columns[match.group(1)])
+        match = re.match(r"^ln_?(.+)", key)
+        if match is not None and match.group(1) in columns:
+            return np.log(columns[match.group(1)])
+        raise KeyError(f"'{key}' is not a valid data type.")
+
+    def header(self, key):
+        return self.header_data[key]
+
+
+
+# Load a MESA output file, going through the binary cache if possible.
+# columns: only load these columns (plus model_number), None to load all of them.
+# Returns the MesaColumns object and the cache's meta dictionary (None if the cache is turned off or couldn't be written).
+def _load_mesadata(filepath, columns=None):
+    meta = _read_cache_meta(filepath) if use_binary_cache else None
+
+    if meta is None:
+        # Take the signature before parsing: if the file is being appended to while it's read, the cache will look stale next time
+        signature = grid_catalog.file_signature(filepath)
+        bulk_names, header_names, header_data = grid_catalog.read_mesa_header(filepath)
+        meta = {
+            "cache_version": CACHE_VERSION,
+            "size": signature[0],
+            "mtime_ns": signature[1],
+            "hash": _file_hash(filepath) if use_binary_cache else None,
+            "bulk_names": bulk_names,
+            "header_names": header_names,
+            "header_data": header_data,
+            "cached": [],
+        }
+
+    # Parse whichever requested columns aren't cached yet
+    bulk_names = meta["bulk_names"]
+    wanted = bulk_names if columns is None else _match_columns(list(columns) + ["model_number"], bulk_names)
+    missing = [name for name in wanted if name not in meta["cached"]]
+    parsed = _read_mesa_columns(filepath, bulk_names, missing) if len(missing) > 0 else {}
+
+    # Columns that were just parsed are used directly; everything else is memory-mapped from the cache when it's accessed
+    files = {name: _column_filename(meta, name) for name in wanted if name in meta["cached"]}
+    loaded = {name: parsed[name] for name in wanted if name in parsed}
+    mesa_data = MesaColumns(
+        filepath, _LazyColumns(_cache_path(filepath), files, loaded, float32=use_float32), meta["header_data"], bulk_names)
+
+    # Add the newly parsed columns to the cache
+    if not use_binary_cache:
+        meta = None
+    elif len(parsed) > 0:
+        meta = _write_cache(filepath, meta, parsed)
+    return mesa_data, meta
+
+
+
+
+
+# Everything that is known about one MESA output folder (i.e. "M=1.0/") without loading any data: 
+# the model numbers that have a saved profile, the path to each profile file, and a handle to the history once it's loaded. 
+# Built once per folder by get_folder_index() and shared by load_history() and load_profile(). 
+# run: the folder's up to date grid_catalog.GridRun, if it has one (then profiles.index doesn't need to be read) 
+class MesaFolderIndex: 
+
+    def __init__(self, folder_path, history_file, index_file="profiles.index", run=None): 
+        self.folder_path = folder_path 
+        self.history_filepath = os.path.join(folder_path, history_file) 
+        self.index_filepath = os.path.join(folder_path, index_file) 
+        for filepath in [self.history_filepath, self.index_filepath]: 
+            if not os.path.isfile(filepath): 
+                raise mr.BadPathError(f"{filepath} not found.") 
+
+        # Remember the size/mtime of the files this index was built from, so it can be rebuilt if they change 
+        self.signature = self._current_signature() 
+
+        # Model numbers (sorted) and the profile file that holds each one 
+        if run is not None: 
+            self.model_numbers, self.profile_numbers = grid_catalog.profile_index_arrays(run) 
+        else: 
+            profiles_index = mr.MesaProfileIndex(self.index_filepath) 
+            self.model_numbers = profiles_index.model_numbers 
+            self.profile_numbers = profiles_index.profile_numbers 
+        self.profile_filepaths = {
+            int(modelnum): os.path.join(folder_path, f"profile{profile_number}.data") 
+            for modelnum, profile_number in zip(self.model_numbers, self.profile_numbers)} 
+
+        # Age at each saved profile, filled in the first time a profile is looked up by age (see _profile_ages) 
+        self.profile_ages = None 
+
+        # Only a weak reference is kept, so whoever loaded the history decides how long it stays in memory 
+        self._history_ref = None 
+
+    def _current_signature(self): 
+        return grid_catalog.file_signature(self.history_filepath) + grid_catalog.file_signature(self.index_filepath) 
+
+    def is_stale(self): 
+        try: 
+            return self._current_signature() != self.signature 
+        except OSError: 
+            return True 
+
+    def profile_filepath(self, modelnum): 
+        return self.profile_filepaths[int(modelnum)] 
+
+    # Returns the already-loaded history if it is still in memory, otherwise None 
+    def get_history(self): 
+        if self._history_ref is None: 
+            return None 
+        return self._history_ref() 
+
+    def set_history(self, history): 
+        self._history_ref = weakref.ref(history) 
+
+
+
+# Process-wide dictionary of folder indices, keyed by the folder's path 
+_folder_indices = {} 
+_folder_indices_lock = threading.Lock() 
+
+
+
+# Folder is either the run for mass M in data_folder's catalog, or a MESA output folder chosen directly (with the full history) 
+# Returns the folder path, history file name, and catalog entry (None for a folder chosen directly) 
+def _resolve_folder(M=None, MESA_folder_path=None): 
+    if MESA_folder_path is not None: 
+        return MESA_folder_path, "history.data", None 
+    catalog = get_catalog() 
+    run = catalog.run(M) 
+    return catalog.folder_path(run), run.history_file, run 
+
+
+
+# Get the index of a MESA output folder, building it the first time the folder is used (or if its files changed since) 
+# With a data_bundle, this is the bundle's index of the run (grid_bundle.BundleRunIndex) 
+def get_folder_index(M=None, MESA_folder_path=None): 
+    if data_bundle is not None and MESA_folder_path is None: 
+        return get_bundle().folder_index(M) 
+    folder_path, history_file, run = _resolve_folder(M, MESA_folder_path) 
+    key = (os.path.normpath(folder_path), history_file) 
+    with _folder_indices_lock: 
+        folder_index = _folder_indices.get(key) 
+        if folder_index is None or folder_index.is_stale(): 
+            # If the run changed since the manifest was written, rescan it (and update the manifest) 
+            if run is not None and run.signature != grid_catalog.run_signature(folder_path, history_file): 
+                run = get_catalog().refresh(run) 
+            folder_index = MesaFolderIndex(folder_path, history_file, run=run) 
+            _folder_indices[key] = folder_index 
+    return folder_index 
+
+
+
+
+
+# Current signature ([size, mtime_ns] of the history and of profiles.index) of the run for mass M, read from its files,
+# so it changes as soon as the run is written to (unlike the catalog's, which is from when the run was scanned)
+# With a data_bundle, the signature the run had when the bundle was made 
+def run_signature(M): 
+    if data_bundle is not None: 
+        return get_bundle().run(M).signature 
+    folder_path, history_file, _ = _resolve_folder(M) 
+    return grid_catalog.run_signature(folder_path, history_file) 
+
+
+
+
+
+# Set index, modelnum, and age attributes for each event (i.e. history.index_ZAMS, history.modelnum_ZAMS, history.age_ZAMS)
+def _set_event_attributes(history, events):
+    for name, index in events.items():
+        if index is None:
+            setattr(history, f"index_{name}", np.nan)
+            setattr(history, f"modelnum_{name}", np.nan)
+            setattr(history, f"age_{name}", np.nan)
+        else:
+            setattr(history, f"index_{name}", index)
+            setattr(history, f"modelnum_{name}", int(history.model_number[index]))
+            setattr(history, f"age_{name}", history.star_age[index])
+
+
+
+
+
+# Columns that every history needs, whatever plot it is used for: ages/mass used by all history plots, and the columns used to find events 
+HISTORY_BASE_COLUMNS = ["model_number", "star_age", "star_mass"] + [key for event in evolutionary_events.EVENTS for key in event.columns] 
+
+
+
+# Load a history file and find its evolutionary events (without anything that depends on the rest of the folder) 
+def _load_history_file(history_filepath, columns=None): 
+    if columns is not None: 
+        columns = HISTORY_BASE_COLUMNS + list(columns) 
+    history, meta = _load_mesadata(history_filepath, columns) 
+
+    # Set index, modelnum, and age where each event in evolutionary_events.EVENTS (ZAMS, TAMS, etc) occurs in history 
+    # The indices are saved in the binary cache alongside the columns, so they only need to be computed once per file 
+    if meta is not None and meta.get("events_version") == EVENTS_VERSION: 
+        events = meta["events"] 
+    else: 
+        events = evolutionary_events.find_events([history])[0] 
+        if meta is not None: 
+            meta["events_version"] = EVENTS_VERSION 
+            meta["events"] = events 
+            try: 
+                _write_cache_meta(_cache_path(history_filepath), meta) 
+            except OSError: 
+                pass 
+    _set_event_attributes(history, events)
+    return history 
+
+
+
+
+
+# Histories and profiles from a data_bundle: the same MesaColumns as from a MESA file, with the columns read from the bundle 
+def _bundle_columns(name, columns, header_data, columns_in_file): 
+    if use_float32: 
+        columns = {key: values.astype(np.float32) if values.dtype == np.float64 and key not in FLOAT64_COLUMNS else values 
+                   for key, values in columns.items()} 
+    return MesaColumns(name, columns, header_data, columns_in_file) 
+
+# Names of the bundle's columns needed for a list of keys (None = every column) 
+def _bundle_names(folder_index, columns, modelnum=None): 
+    if columns is None: 
+        return None 
+    entry = folder_index.entry["history"] if modelnum is None else folder_index.entry["profiles"][str(int(modelnum))] 
+    return _match_columns(columns, entry["columns"]) 
+
+def _load_bundle_history(folder_index, columns=None): 
+    if columns is not None: 
+        columns = HISTORY_BASE_COLUMNS + list(columns) 
+    columns, header_data, columns_in_file, events = folder_index.read_history(_bundle_names(folder_index, columns)) 
+    history = _bundle_columns(folder_index.name, columns, header_data, columns_in_file) 
+    _set_event_attributes(history, events) 
+    return history 
+
+
+
+
+
+# columns: list of history columns to load (i.e. ["log_Teff", "log_L"] for an HR diagram), or None to load every column 
+def load_history(M, MESA_folder_path=None, columns=None): 
     
-    if M!=None: 
-        history_filepath = data_folder + f"M={M}" + "/trimmed_history.data"
-    if MESA_folder_path!=None: 
-        history_filepath = MESA_folder_path + "/history.data"
-    history = mr.MesaData(history_filepath)  
-
-    # Set index, modelnum, and age where Zero Age Main Sequence (ZAMS) occurs in history  
-    try: 
-        #ind_ZAMS = np.where(np.abs(history.center_h1 - history.center_h1[0])/history.center_h1[0] > 0.001)[0][0] 
-        ind_ZAMS = np.where(history.log_LH - history.log_L > np.log10(0.999) )[0][0] 
-        history.index_ZAMS = ind_ZAMS 
-        history.modelnum_ZAMS = ind_ZAMS+1
-        history.age_ZAMS = history.star_age[ind_ZAMS]
-    except (IndexError, ValueError): 
-        history.index_ZAMS = np.nan  
-        history.modelnum_ZAMS = np.nan 
-        history.age_ZAMS = np.nan 
-
-    # Set index, modelnum, and age where Terminal Age Main Sequence (TAMS) occurs in history 
-    try: 
-        ind_TAMS = np.where(history.he_core_mass>0)[0][0] 
-        history.index_TAMS = ind_TAMS 
-        history.modelnum_TAMS = ind_TAMS+1 
-        history.age_TAMS = history.star_age[ind_TAMS] 
-    except (IndexError, ValueError): 
-        history.index_TAMS = np.nan  
-        history.modelnum_TAMS = np.nan  
-        history.age_TAMS = np.nan 
-
-    # Find the earliest point in time after TAMS where the helium core fraction drops, which indicates helium fusion has started
-    try:  
-        ind1 = np.where((history.center_he4[history.index_TAMS]-history.center_he4)/history.center_he4[history.index_TAMS] > 0.0001) 
-        # ind1 = np.where(history.log_LHe>0)[0][0]
-        # ind1 = np.where(history.log_LHe - history.log_L > np.log10(0.999))
-        ind2 = np.where(history.star_age>history.age_TAMS)
-        ind_both = np.intersect1d(ind1, ind2)
-        index_He_fusion = np.nanmin(ind_both) 
-        history.index_He_fusion = index_He_fusion 
-        history.modelnum_He_fusion = index_He_fusion+1 
-        history.age_He_fusion = history.star_age[index_He_fusion] 
-        if len(ind_both)==0: 
-            history.index_He_fusion = np.nan 
-            history.modelnum_He_fusion = np.nan
-            history.age_He_fusion = np.nan 
-
-        # ind_He_fusion = np.where(history.c_core_mass>0)[0][0] 
-        # history.index_He_fusion = ind_He_fusion 
-        # history.modelnum_He_fusion = ind_He_fusion+1 
-        # history.age_He_fusion = history.star_age[ind_He_fusion] 
-
-    except (IndexError, ValueError): 
-        history.index_He_fusion = np.nan 
-        history.modelnum_He_fusion = np.nan  
-        history.age_He_fusion = np.nan 
+    # Reuse the history if this folder's history was already loaded, is still in memory, and has the requested columns 
+    # If it's missing some columns, load them along with the ones it already has 
+    folder_index = get_folder_index(M, MESA_folder_path) 
+    history = folder_index.get_history() 
+    if history is not None: 
+        if len(_missing_columns(history, columns)) == 0: 
+            return history 
+        if columns is not None: 
+            columns = list(history.bulk_names) + list(columns) 
+
+    if isinstance(folder_index, grid_bundle.BundleRunIndex): 
+        history = _load_bundle_history(folder_index, columns) 
+    else: 
+        history = _load_history_file(folder_index.history_filepath, columns) 
 
     # Set availbe model numbers 
-    folder_mesa = mr.MesaLogDir(data_folder + f"M={M}", history_file="trimmed_history.data") 
-    history.model_numbers_available = folder_mesa.model_numbers
+    history.model_numbers_available = folder_index.model_numbers 
+    folder_index.set_history(history) 
     return history 
 
 
 
 
 
-def load_profile(M, history, index=None, modelnum=None, age=None, skip_n_models=0): 
+# Follow the history of a MESA run that is still going. Each update() only parses the rows appended since the last update 
+# (it remembers the byte offset where the last complete row ended), and only checks those rows for new evolutionary events, 
+# so an update costs the same however long the history has grown. 
+# follower.history is a history like the ones load_history() returns (event attributes, model_numbers_available), 
+# and stays the same object between updates. 
+# Example usage: 
+# follower = load_data.HistoryFollower(MESA_folder_path="path/to/LOGS", columns=["log_Teff", "log_L"]) 
+# n_new_rows = follower.update() 
+# hr.add_path(follower.history) 
+class HistoryFollower: 
+
+    def __init__(self, M=None, MESA_folder_path=None, columns=None): 
+        self.M = M 
+        self.MESA_folder_path = MESA_folder_path 
+        folder_path, history_file, _ = _resolve_folder(M, MESA_folder_path) 
+        self.history_filepath = os.path.join(folder_path, history_file) 
+        self.index_filepath = os.path.join(folder_path, "profiles.index") 
+        self.requested_columns = columns 
+        self.history = None 
+        self._reset() 
+        self.update() 
+
+    # Start again from the first row (also used if the file gets shorter, i.e. the run was started over) 
+    def _reset(self): 
+        bulk_names, _, header_data = grid_catalog.read_mesa_header(self.history_filepath) 
+        if self.requested_columns is None: 
+            self._names = list(bulk_names) 
+        else: 
+            self._names = _match_columns(HISTORY_BASE_COLUMNS + list(self.requested_columns), bulk_names) 
+        self._bulk_names = bulk_names 
+        with open(self.history_filepath, "rb") as file: 
+            for _ in range(6): 
+                file.readline() 
+            self._offset = file.tell() 
+        self._buffers = {} # Column name -> array with room to append more rows; only the first self._n rows are used 
+        self._n = 0 
+        self._events = {} 
+        self._index_signature = None 
+
+        # Empty until the first rows are parsed (a run that just started may not have any yet) 
+        if self.history is None: 
+            self.history = MesaColumns(self.history_filepath, {}, header_data, bulk_names) 
+        self.history.header_data = header_data 
+        self.history.columns_in_file = tuple(bulk_names) 
+        self.history.columns = {name: np.empty(0) for name in self._names} 
+        self.history.model_numbers_available = np.empty(0, dtype=int) 
+        _set_event_attributes(self.history, {event.name: None for event in evolutionary_events.EVENTS}) 
+
+    # Add rows to the end of the buffers, doubling a buffer's size whenever it runs out of room 
+    def _append(self, columns): 
+        n_new = len(columns["model_number"]) 
+        for name, values in columns.items(): 
+            buffer = self._buffers.get(name) 
+            if buffer is None: 
+                dtype = values.dtype 
+                if use_float32 and dtype == np.float64 and name not in FLOAT64_COLUMNS: 
+                    dtype = np.float32 
+                buffer = np.empty(max(n_new, 1024), dtype=dtype) 
+            elif self._n + n_new > len(buffer): 
+                grown = np.empty(max(2*len(buffer), self._n + n_new), dtype=buffer.dtype) 
+                grown[:self._n] = buffer[:self._n] 
+                buffer = grown 
+            buffer[self._n:self._n + n_new] = values 
+            self._buffers[name] = buffer 
+        self._n += n_new 
+
+    # Parse rows appended to the history since the last update, and pick up newly saved profiles. Returns the number of new rows 
+    def update(self): 
+        try: 
+            if os.path.getsize(self.history_filepath) < self._offset: 
+                self._reset() 
+            with open(self.history_filepath, "rb") as file: 
+                file.seek(self._offset) 
+                new_bytes = file.read() 
+        except OSError: 
+            return 0 
+
+        # Only parse complete rows: MESA may be in the middle of writing the last one 
+        end = new_bytes.rfind(b"\n") + 1 
+        new_rows = _remove_backups(_parse_mesa_rows(new_bytes[:end].decode().splitlines(), self._bulk_names, self._names)) 
+        self._offset += end 
+        n_new = len(new_rows["model_number"]) 
+
+        if n_new > 0: 
+            # After a backup or restart, MESA rewrites rows starting from an earlier model number: drop the old copies of those rows 
+            start = self._n 
+            if self._n > 0: 
+                start = int(np.searchsorted(self._buffers["model_number"][:self._n], new_rows["model_number"][0])) 
+                self._n = start 
+            self._append(new_rows) 
+
+            # Views of the used part of each buffer, so nothing is copied 
+            self.history.columns = {name: buffer[:self._n] for name, buffer in self._buffers.items()} 
+            self._events = evolutionary_events.update_events(self.history, self._events, start) 
+            _set_event_attributes(self.history, self._events) 
+
+        # Re-read the list of saved profiles only when profiles.index has changed 
+        try: 
+            index_signature = grid_catalog.file_signature(self.index_filepath) 
+        except OSError: 
+            index_signature = None 
+        if index_signature is not None and index_signature != self._index_signature: 
+            try: 
+                self.history.model_numbers_available = get_folder_index(self.M, self.MESA_folder_path).model_numbers 
+                self._index_signature = index_signature 
+            except ValueError: 
+                pass # profiles.index has no profiles in it yet 
+
+        return n_new 
+
+
+
+
+
+# Position in a sorted array of the value that best matches target, found by binary search 
+# policy: "next" = first value at or after target, "previous" = last value at or before target, "nearest" = whichever is closer 
+def _search_sorted(sorted_values, target, policy="next"): 
+    if policy not in ["next", "previous", "nearest"]: 
+        raise ValueError(f"policy must be 'next', 'previous', or 'nearest', not {policy!r}") 
+
+    i_next = int(np.searchsorted(sorted_values, target, side="left")) 
+    if i_next < len(sorted_values) and sorted_values[i_next] == target: 
+        return i_next 
+    i_previous = i_next-1 
+
+    if policy == "next": 
+        i = i_next 
+    elif policy == "previous": 
+        i = i_previous 
+    elif i_next >= len(sorted_values): 
+        i = i_previous 
+    elif i_previous < 0: 
+        i = i_next 
+    else: 
+        i = i_next if sorted_values[i_next]-target < target-sorted_values[i_previous] else i_previous 
+
+    if not 0 <= i < len(sorted_values): 
+        raise ValueError(f"No saved profile found {policy} {target}") 
+    return i 
+
+
+
+# Age of the star at each saved profile, in the same order as folder_index.model_numbers 
+# Forced to never decrease (np.maximum.accumulate) so it can be binary searched 
+def _profile_ages(folder_index, history): 
+    if folder_index.profile_ages is None: 
+        rows = helpers.model_rows(history, folder_index.model_numbers) 
+        folder_index.profile_ages = np.maximum.accumulate(np.asarray(history.star_age)[rows]) 
+    return folder_index.profile_ages 
+
+
+
+# Model number of the profile that load_profile() would load 
+# Give either modelnum or age (age also needs the history). If there is no profile exactly at modelnum/age, policy decides 
+# which one to use ("next", "previous", or "nearest"). Then skip forward or back skip_n_models saved profiles. 
+def _resolve_modelnum(folder_index, modelnum=None, skip_n_models=0, policy="next", age=None, history=None): 
+    model_numbers = folder_index.model_numbers 
+    if age is not None: 
+        i = _search_sorted(_profile_ages(folder_index, history), age, policy) 
+    else: 
+        i = _search_sorted(model_numbers, modelnum, policy) 
+
+    # Skip forward or back n models (useful to check the previous and next model to the intended one)
+    i += skip_n_models 
+    if not 0 <= i < len(model_numbers): 
+        raise IndexError(f"Skipping {skip_n_models} models goes past the first/last saved profile") 
+    return model_numbers[i] 
+
+
+
+
+
+# columns: list of profile columns to load (i.e. ["mass", "log_D_conv"]), or None to load every column 
+def load_profile(M, history, index=None, modelnum=None, age=None, skip_n_models=0, MESA_folder_path=None, policy="next", columns=None): 
     
     # Mutually exclusive arguments: Supply either the intended index,  model number, or age, but not multiple of those options. 
     args = [index, modelnum, age]
@@ -85,24 +746,24 @@ def load_profile(M, history, index=None, modelnum=None, age=None, skip_n_models=
     elif given > 1:
         raise ValueError("Only one of: index, modelnum, or age may be specified.")
     
-    # If index was chosen, convert to model number 
+    # If index (row of the history) was chosen, convert to model number 
     if index is not None: 
-        modelnum = index+1 
+        modelnum = int(history.model_number[index]) 
     
-    # If the intended profile doesn't exist, step forward until you find one that does 
-    folder_mesa = mr.MesaLogDir(data_folder + f"M={M}", history_file="trimmed_history.data") 
-    model_numbers = folder_mesa.model_numbers 
-    while modelnum not in model_numbers: 
-        modelnum += 1 
-
-    # Skip forward or back n models (useful to check the previous and next model to the intended one)
-    index_modelnum = np.where(model_numbers==modelnum)[0][0]
-    modelnum = model_numbers[index_modelnum+skip_n_models]
+    # Find the model number of the profile to load 
+    # If the intended profile doesn't exist, policy decides whether to use the "next", "previous", or "nearest" one that does 
+    folder_index = get_folder_index(M, MESA_folder_path) 
+    modelnum = _resolve_modelnum(folder_index, modelnum, skip_n_models, policy=policy, age=age, history=history) 
 
     # Load profile 
-    profile = folder_mesa.profile_data(modelnum)     
+    # Goes through the binary cache: the first load converts the requested columns to one .npy file per column, after that 
+    # only the columns a plot actually uses (i.e. profile.h1, profile.log_D_conv) are memory-mapped from disk 
+    if isinstance(folder_index, grid_bundle.BundleRunIndex): 
+        profile = _bundle_columns(folder_index.name, *folder_index.read_profile(modelnum, _bundle_names(folder_index, columns, modelnum))) 
+    else: 
+        profile, _ = _load_mesadata(folder_index.profile_filepath(modelnum), columns) 
     profile.modelnum = modelnum 
-    profile.index = modelnum-1 
+    profile.index = int(helpers.model_rows(history, modelnum)) 
     profile.age = history.star_age[profile.index] 
     profile.total_mass = M 
     return profile
@@ -110,3 +771,213 @@ def load_profile(M, history, index=None, modelnum=None, age=None, skip_n_models=
 
 
 
+
+
+# Approximate memory used by a loaded history/profile: only columns that have actually been read count 
+def _estimate_nbytes(mesa_data): 
+    columns = mesa_data.columns 
+    if isinstance(columns, _LazyColumns): 
+        return sum(column.nbytes for column in columns.loaded.values()) 
+    return sum(np.asarray(column).nbytes for column in columns.values()) 
+
+
+
+
+
+# Runs in a worker process during StellarGrid.preload(): parse one history or profile file and write its binary cache. 
+# Only the file path is sent back; the parent process then memory-maps the cached columns, so no arrays need to be pickled. 
+def _build_cache_worker(filepath, is_history): 
+    if is_history: 
+        _load_history_file(filepath) 
+    else: 
+        _load_mesadata(filepath) 
+    return filepath 
+
+
+
+
+
+# Histories and profiles for the whole grid, loaded the first time they're asked for instead of all at startup. 
+# Everything that has been loaded is kept in a least-recently-used cache limited to max_bytes; 
+# when it's full, whatever was used longest ago is dropped (and simply loaded again if it's needed later). 
+# Each entry remembers the run's signature (see run_signature) from when it was loaded, so once a run's files change 
+# (i.e. a run that's still going), its histories and profiles are loaded again instead of being served stale. 
+# masses: the masses in the grid, or None for every mass in data_folder's catalog 
+# Example usage: 
+# grid = load_data.StellarGrid(masses=[0.2, 0.5, 1.0, 3.0]) 
+# history = grid.history(1.0) 
+# profile = grid.profile(1.0, modelnum=296) 
+class StellarGrid: 
+
+    def __init__(self, masses=None, max_bytes=512*2**20): 
+        self.masses = list(masses) if masses is not None else get_catalog().masses() 
+        self.max_bytes = max_bytes 
+        self._cache = OrderedDict() # key -> [loaded object, nbytes, run signature when it was loaded] 
+        self._lock = threading.RLock() 
+        self._key_locks = {} # key -> lock held while that key is being loaded, so two threads never load the same file at once 
+
+        # Background prefetching of neighboring profiles (see prefetch_neighbors) 
+        self._prefetch_executor = None 
+        self._prefetch_generation = 0 
+
+        self._events = None 
+        self._events_signatures = None 
+
+    @property 
+    def total_bytes(self): 
+        return sum(nbytes for _, nbytes, _ in self._cache.values()) 
+
+    def __contains__(self, key): 
+        return key in self._cache 
+
+    # Return the cached object for key (loading it with load_func(columns) if needed) and mark it as most recently used 
+    # If the cached object doesn't have all of the requested columns, it's loaded again with its old columns plus the new ones 
+    # key: (kind, M, ...). If run M's files changed since the object was loaded, every entry for M is dropped and it's loaded again 
+    def _get(self, key, load_func, columns=None): 
+        signature = run_signature(key[1]) 
+        with self._lock: 
+            entry = self._cache.get(key) 
+            if entry is not None and entry[2] != signature: 
+                self._drop_run(key[1]) 
+            if entry is not None and entry[2] == signature and len(_missing_columns(entry[0], columns)) == 0: 
+                self._cache.move_to_end(key) 
+                entry[1] = _estimate_nbytes(entry[0]) # Columns may have been paged in since the last access 
+                self._evict() 
+                return entry[0] 
+            key_lock = self._key_locks.setdefault(key, threading.Lock()) 
+
+        with key_lock: 
+
+            # Another thread may have finished loading this key while we were waiting for the lock 
+            with self._lock: 
+                entry = self._cache.get(key) 
+                if entry is not None and entry[2] == signature and len(_missing_columns(entry[0], columns)) == 0: 
+                    return entry[0] 
+                if entry is not None and columns is not None: 
+                    columns = list(entry[0].bulk_names) + list(columns) 
+
+            value = load_func(columns) 
+
+            with self._lock: 
+                self._cache[key] = [value, _estimate_nbytes(value), signature] 
+                self._cache.move_to_end(key) 
+                self._evict() 
+                self._key_locks.pop(key, None) 
+        return value 
+
+    # Drop least recently used entries until under budget (the most recent entry is always kept, even if it alone is too big) 
+    def _evict(self): 
+        total = self.total_bytes 
+        while total > self.max_bytes and len(self._cache) > 1: 
+            _, (_, nbytes, _) = self._cache.popitem(last=False) 
+            total -= nbytes 
+
+    # Forget everything loaded from run M (and the events, which were found from its old history) 
+    def _drop_run(self, M): 
+        for key in [key for key in self._cache if key[1] == M]: 
+            del self._cache[key] 
+        self._events = None 
+
+    # columns: history columns needed by the caller (None = all of them). See load_history() 
+    def history(self, M, columns=None): 
+        return self._get(("history", M), lambda columns: load_history(M, columns=columns), columns) 
+
+    # Index of every evolutionary event for every mass, found in a single vectorized pass over all histories 
+    # Returns a dictionary: mass -> {event name -> index in that mass's history (None if not found)} 
+    # Found again if any run changed since they were found 
+    def events(self): 
+        signatures = [run_signature(M) for M in self.masses] 
+        if self._events is None or self._events_signatures != signatures: 
+            self._events_signatures = signatures 
+            histories = [self.history(M, columns=[]) for M in self.masses] # columns=[]: only the columns used to find events 
+            self._events = dict(zip(self.masses, evolutionary_events.find_events(histories))) 
+        return self._events 
+
+    # Profiles are cached under the model number that is actually loaded, so i.e. profile(1.0, 295, skip_n_models=1) 
+    # and profile(1.0, 296) share one cache entry if they resolve to the same profile 
+    def profile(self, M, modelnum=None, skip_n_models=0, age=None, policy="next", columns=None): 
+        history = self.history(M, columns=[]) if age is not None else None 
+        modelnum = _resolve_modelnum(get_folder_index(M), modelnum, skip_n_models, policy=policy, age=age, history=history) 
+        return self._get(
+            ("profile", M, modelnum), 
+            lambda columns: load_profile(M, self.history(M, columns=[]), modelnum=modelnum, columns=columns), 
+            columns) 
+
+    # Load the profiles just before and after the one being shown (up to k in each direction) on a background thread, 
+    # so stepping through neighboring models with skip_n_models doesn't have to wait for a file to be parsed. 
+    # Calling this again (i.e. because the selection jumped elsewhere) cancels the prefetch that was in progress. 
+    def prefetch_neighbors(self, M, modelnum, k=2, columns=None): 
+        model_numbers = get_folder_index(M).model_numbers 
+        i_center = int(np.searchsorted(model_numbers, _resolve_modelnum(get_folder_index(M), modelnum))) 
+
+        # Nearest neighbors first: +1, -1, +2, -2, ... 
+        neighbors = [] 
+        for step in range(1, k+1): 
+            for i in [i_center+step, i_center-step]: 
+                if 0 <= i < len(model_numbers): 
+                    neighbors.append(model_numbers[i]) 
+
+        with self._lock: 
+            self._prefetch_generation += 1 
+            generation = self._prefetch_generation 
+            if self._prefetch_executor is None: 
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile_prefetch") 
+
+        def prefetch(): 
+            for neighbor in neighbors: 
+                if generation != self._prefetch_generation: 
+                    return # A newer prefetch has been requested 
+                self.profile(M, neighbor, columns=columns) 
+
+        return self._prefetch_executor.submit(prefetch) 
+
+    def cancel_prefetch(self): 
+        with self._lock: 
+            self._prefetch_generation += 1 
+
+    # Load every history and profile needed for a list of (mass, modelnum) pairs ahead of time, i.e. on a lecture machine before class. 
+    # The slow part (parsing the ASCII files) is spread across a pool of processes that each write the binary cache; 
+    # afterwards the parent only has to memory-map the cached columns. 
+    # progress is an optional wrapper around the iterator of finished files, i.e. 
+    # progress=lambda it, total: mo.status.progress_bar(it, total=total, title="Loading grid") 
+    # Note that everything still goes through the LRU cache, so only the most recently loaded max_bytes stay in memory. 
+    def preload(self, models, max_workers=None, progress=None): 
+        models = list(models) 
+        masses = list(dict.fromkeys(M for M, _ in models)) 
+
+        # Find every file that needs to be parsed 
+        tasks = [] 
+        for M in masses: 
+            tasks.append((get_folder_index(M).history_filepath, True)) 
+        for M, modelnum in models: 
+            folder_index = get_folder_index(M) 
+            tasks.append((folder_index.profile_filepath(_resolve_modelnum(folder_index, modelnum)), False)) 
+        tasks = list(dict.fromkeys(tasks)) if data_bundle is None else [] # A bundle has nothing to parse 
+
+        # Without the binary cache, parsed data can't be handed back cheaply, so everything is parsed in this process instead 
+        parallel = use_binary_cache and max_workers != 1 
+        if parallel: 
+            executor = ProcessPoolExecutor(max_workers=max_workers) 
+            futures = [executor.submit(_build_cache_worker, filepath, is_history) for filepath, is_history in tasks] 
+            finished = (future.result() for future in as_completed(futures)) 
+        else: 
+            finished = (_build_cache_worker(filepath, is_history) for filepath, is_history in tasks) 
+
+        if progress is not None: 
+            finished = progress(finished, len(tasks)) 
+        try: 
+            for _ in finished: 
+                pass 
+        finally: 
+            if parallel: 
+                executor.shutdown(cancel_futures=True) 
+
+        # Load into the LRU cache (just memory-mapping, since the binary cache was built above) 
+        for M in masses: 
+            self.history(M) 
+        for M, modelnum in models: 
+            self.profile(M, modelnum) 
+
+    def clear(self): 
+        with self._lock: 
+            self._cache.clear() 
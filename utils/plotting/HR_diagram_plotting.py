@@ -1,10 +1,20 @@
+import math 
+import functools 
+import itertools 
+
 import numpy as np 
-from fractions import Fraction 
 
-import matplotlib.pyplot as plt 
 import matplotlib.ticker as mticker 
+import matplotlib.colors as mcolors 
+from matplotlib.collections import LineCollection 
+from matplotlib.image import AxesImage 
 
+import utils.helpers as helpers 
+import utils.lazy_import as lazy_import 
 import utils.config.plot_options as plot_options 
+import utils.plotting.figure_reuse as figure_reuse 
+
+isochrones = lazy_import.lazy_module("utils.isochrones") # Only needed (and imported) once an isochrone is drawn 
 
 
 
@@ -32,124 +42,109 @@ class MinorLogLocator(mticker.Locator):
 
 
 
-# Do not ask me how this works. Too lazy to add comments right now 
-def calc_log_ticks(left, right, remove_overlaps=True):
-    xmin = np.min([left, right])
-    xmax = np.max([left, right])
-
-
-
-    def calc_next_depth(depth): 
-        if depth == 0: 
-            return 1 
-        exp = int(np.floor(np.log10(depth)))
-        mant = depth / (10**exp)  
-        if mant == 1: 
-            return int(depth*2) 
-        if mant == 2: 
-            return int(depth*2.5)
-        if mant == 5: 
-            return int(depth*2) 
-        
-
-
-    def calc_gaps(input_array, minmax_func=np.min): 
+# Ticks for a log axis between left and right: the view's edges, plus round numbers (1, 2, 5, 10, 20, ... subdivided as far as
+# needed so no gap is more than f_max of the axis). With remove_overlaps (for labeled ticks), ticks closer than f_min of the axis
+# to a neighbor are removed one at a time, least "nice" number first (see _niceness_rank), then closest to its neighbor first.
+# Locators call this on every draw, so the result is memoized on the view interval (rounded to QUANTIZE_DIGITS significant digits,
+# far below a pixel), and a zoom that comes back to the same view doesn't recompute anything.
+# utils/plotting/log_ticks_benchmark.py compares it with the original (loop/Fraction) version over a sweep of zoom ranges
+QUANTIZE_DIGITS = 10
 
-        # Get sorting indices
-        sort_idx = np.argsort(input_array)
-        sorted_array = input_array[sort_idx]
-
-        # Calculate gaps 
-        gaps = [] 
-        for i in range(len(sorted_array)): 
-            if i==0: 
-                gap = np.log10(sorted_array[1]/sorted_array[0])
-            elif i==len(sorted_array)-1: 
-                gap = np.log10(sorted_array[i]/sorted_array[i-1])
-            else: 
-                next_gap = np.log10(sorted_array[i+1] / sorted_array[i])
-                prev_gap = np.log10(sorted_array[i] / sorted_array[i-1])
-                gap = minmax_func([next_gap, prev_gap])
-            gaps.append(gap)
-        gaps = np.array(gaps)
+def calc_log_ticks(left, right, remove_overlaps=True):
+    xmin = _quantize(min(left, right))
+    xmax = _quantize(max(left, right))
+    return _cached_log_ticks(xmin, xmax, remove_overlaps).copy()
 
-        # Invert the sorting to get back to original order
-        inverse_idx = np.argsort(sort_idx)
-        unsorted_gaps = gaps[inverse_idx]
 
-        return unsorted_gaps 
 
+def _quantize(x):
+    x = float(x)
+    if not math.isfinite(x) or x <= 0:
+        return x
+    return round(x, QUANTIZE_DIGITS - 1 - math.floor(math.log10(x)))
 
 
-    start_exp = int(np.floor(np.log10(xmin)))
-    stop_exp = int(np.floor(np.log10(xmax)))
-    depth = 0 
-    f_max = 0.5  
-    f_min = 0.1
-    length = np.log10(xmax / xmin) 
-    array = np.array([]) 
-    gaps = np.array([length]) 
 
+# Every mantissa of a decade subdivided into `depth` steps, for each decade from 10**start_exp to 10**stop_exp
+# (same values as np.arange(base, 10*base + step, step) for each decade)
+def _log_grid(start_exp, stop_exp, depth):
+    bases = 10.0**np.arange(start_exp, stop_exp+1)
+    steps = (bases + bases/depth) - bases
+    return (bases[:, None] + np.arange(9*depth + 1)[None, :]*steps[:, None]).ravel()
 
 
-    # Keep subdividing until the largest gap between ticks is smaller than f_max 
-    # This will mean the smallest gaps are way too small, but we will remove those points in the next step 
-    while len(array) < 4 or (np.max(gaps)>f_max*length):
 
-        depth = calc_next_depth(depth) 
+# How "nice" each value is, from the fraction closest to the decimal part of its mantissa (denominator at most 100): the rank is
+# its denominator, so whole mantissas (1, 2, 3, ...) are 1, halves (1.5, 2.5, ...) are 2, fifths (1.2, 1.4, ...) are 5, and so on
+_DENOMINATORS = np.arange(1, 101)
 
-        arrs = []
-        for k in range(start_exp, stop_exp+1):
-            base = 10**k
-            step = base / depth   # e.g. depth=2 → 500, depth=5 → 200
-            arr = np.arange(base, 10*base + step, step)
-            arrs.append(arr)
+def _niceness_rank(values):
+    mant = values / 10**np.floor(np.log10(values))
+    dec = np.round(mant % 1, 10)[:, None, None]
 
-        array = np.unique(np.concatenate(arrs))
-        array = array[(array >= xmin) & (array <= xmax)]
-        array = np.append(array, xmin)
-        array = np.append(array, xmax) 
-        array = np.unique(array) 
-        array = np.sort(array) 
+    # The fractions on either side of each decimal for every denominator, reduced (2/10 is 1/5)
+    lower = np.floor(dec[:, :, 0]*_DENOMINATORS)[:, :, None]
+    numerators = np.concatenate([lower, lower+1], axis=2).astype(int)
+    denominators = _DENOMINATORS[:, None]
+    errors = np.abs(dec - numerators/denominators)
+    reduced = denominators // np.gcd(numerators, denominators)
 
-        gaps = calc_gaps(array, minmax_func=np.max) 
+    # When fractions are equally close (i.e. 0.005, halfway between 0/1 and 1/100), the larger denominator is used,
+    # so a number that's only nearly round isn't treated as round
+    closest = errors == np.min(errors, axis=(1, 2), keepdims=True)
+    return np.max(np.where(closest, reduced, 0), axis=(1, 2))
 
 
 
-    # First, check if we even want to remove overlapping points. 
-    # If this is for minor tick LINES, leave overlapping points in so the gridline spacing 
-    # matches what you would expect for a log plot, but for major tick LABELS, we don't want any text to overlap. 
-    # When removing overlapping points, prioritize keeping "nicer" numbers. 
+def _compute_log_ticks(xmin, xmax, remove_overlaps=True, f_max=0.5, f_min=0.1):
+    if xmin == xmax:
+        return np.array([xmin])
+    start_exp = int(np.floor(np.log10(xmin)))
+    stop_exp = int(np.floor(np.log10(xmax)))
+    length = np.log10(xmax / xmin)
+
+    # Keep subdividing (depth 1, 2, 5, 10, 20, ...) until the largest gap between ticks is smaller than f_max of the axis
+    # This will mean the smallest gaps are way too small, but those points are removed in the next step
+    # Depths whose smallest step (at the top of a decade, log10(1 + 1/(10*depth))) is already wider than that can't work
+    # (the view would hold at most one grid point), so they're skipped without building their grid
+    depths = (mult*10**exp for exp in itertools.count() for mult in (1, 2, 5))
+    depth = next(depths)
+    while np.log10(1 + 1/(10*depth)) > f_max*length:
+        depth = next(depths)
+    while True:
+        array = _log_grid(start_exp, stop_exp, depth)
+        array = np.unique(np.concatenate([array[(array >= xmin) & (array <= xmax)], [xmin, xmax]]))
+        if len(array) >= 4 and np.max(np.log10(array[1:] / array[:-1])) <= f_max*length:
+            break
+        depth = next(depths)
+
+    # For minor tick LINES, leave overlapping points in so the gridline spacing matches what you would expect for a log plot,
+    # but for major tick LABELS, we don't want any text to overlap. Points are removed one at a time, least nice first
     # Example: If 5, 6, 7, 8, 9, 10, 20, 30, 40, 50, 60 etc were the initial labels: 
     # First get rid of 0.1 numbers (what's left: 6, 8, 10, 20, 40, etc)
     # Then get rid of 0.2 numbers (what's left: 5, 10, 15, 20, 25)
     # Then get rid of 0.5 numbers (what's left: 10, 100, 1000) 
-    # Prioritize keeping 0.0
-    # Keep removing points until no remaining labels are overlapping/too close 
-    while remove_overlaps==True:
-
-        gaps = calc_gaps(array) 
-
-        if len(gaps) < 1 or np.min(gaps) >= f_min*length:
-            break 
-
-        array_too_close = array[np.where(gaps<f_min*length)]
-
-        exp = np.floor(np.log10(array_too_close)) 
-        mant = array_too_close / (10**exp) 
-        dec = np.array([round(x%1, 10) for x in mant])
-        denoms = np.array([Fraction(x).limit_denominator(100).denominator for x in dec])
-
-        array_least_significant = array_too_close[np.where(denoms==np.max(denoms))] 
-        ind_removal_candidates = np.array([np.where(array==x)[0][0] for x in array_least_significant]) 
-        ind_remove = np.where(array == array[ind_removal_candidates][np.argmin(np.array(gaps)[ind_removal_candidates])])[0][0]
-
-        array = np.delete(array, ind_remove)
-
-    return array 
-
+    # Removing a point only widens its neighbors' gaps, so only the points that are too close to begin with ever need a rank
+    if remove_overlaps:
+        ranks = None
+        while True:
+            gaps = np.log10(array[1:] / array[:-1])
+            gaps = np.concatenate([[np.inf], gaps, [np.inf]])
+            point_gaps = np.minimum(gaps[:-1], gaps[1:]) # Gap from each point to its nearest neighbor 
+            too_close = point_gaps < f_min*length
+            if not too_close.any():
+                break
+            if ranks is None:
+                ranks = np.zeros(len(array), dtype=int)
+                ranks[too_close] = _niceness_rank(array[too_close])
+            candidates = np.flatnonzero(too_close & (ranks == np.max(ranks[too_close])))
+            i = candidates[np.argmin(point_gaps[candidates])]
+            array = np.delete(array, i)
+            ranks = np.delete(ranks, i)
 
+    return array
 
+_cached_log_ticks = functools.lru_cache(maxsize=1024)(_compute_log_ticks)
 
 
 
@@ -216,12 +211,121 @@ class SpectralTypeLabelFormatter(mticker.Formatter):
 
 
 
+# Tracks of many masses drawn by HRDiagram.add_paths, as one LineCollection (one path per mass) colored by mass
+# Highlighting a mass only changes the collection's arrays (alpha, draw order), so nothing is plotted again 
+class TrackCollection: 
+
+    def __init__(self, collection, tracks, masses, alpha): 
+        self.collection = collection 
+        self.tracks = tracks 
+        self.masses = np.asarray(masses, dtype=float) 
+        self.alpha = alpha 
+        self.highlighted = np.zeros(len(self.masses), dtype=bool) 
+        self.marker = None # Line marking the highlighted masses on the colorbar, if there is one 
+
+    # Draw the tracks of these masses (None = no mass) opaque and on top, and every other track with self.alpha 
+    # With no mass highlighted, every track is opaque 
+    def highlight(self, masses=None): 
+        if masses is None: 
+            self.highlighted = np.zeros(len(self.masses), dtype=bool) 
+        else: 
+            self.highlighted = np.any(np.abs(self.masses[:, None] - np.atleast_1d(masses)[None, :]) < 1e-6, axis=1) 
+        self._update() 
+
+    def set_alpha(self, alpha): 
+        self.alpha = alpha 
+        self._update() 
+
+    def _update(self): 
+        order = np.argsort(self.highlighted, kind="stable") # Highlighted tracks last, so they're drawn on top 
+        alphas = np.where(self.highlighted | ~np.any(self.highlighted), 1.0, self.alpha) 
+        self.collection.set_segments([self.tracks[i] for i in order]) 
+        self.collection.set_array(self.masses[order]) 
+        self.collection.set_alpha(alphas[order]) 
+        self.collection.stale = True 
+        if self.marker is not None: 
+            marked = self.masses[self.highlighted] 
+            self.marker.set_data(np.repeat(marked, 3), np.tile([0, 1, np.nan], len(marked))) 
+
+
+
+
+
+
+
+
+
+
+# Density of (log_Teff, log_L) samples drawn by HRDiagram.add_density, as one image binned at the axes' pixel resolution
+# The samples are binned again whenever the view (zoom/pan) or the axes' size in pixels has changed since the last draw,
+# so the image always has one bin per pixels_per_bin screen pixels. Binning is a bincount over the samples inside the
+# view's temperature range (found with searchsorted, the samples are sorted by log_Teff once), and drawing the image costs
+# the same however many samples there are.
+# Each bin is the total weight in it per dex^2, so colors don't change with the bin size (zoom level)
+class DensityImage(AxesImage): 
+
+    def __init__(self, ax, log_Teff, log_L, weights, cmap="viridis", pixels_per_bin=2, **kwargs): 
+        super().__init__(ax, cmap=cmap, norm=mcolors.LogNorm(), origin="lower", extent=(0, 1, 0, 1), 
+                         interpolation="nearest", transform=ax.transAxes, **kwargs) 
+        order = np.argsort(log_Teff, kind="stable") 
+        self.log_Teff = log_Teff[order] 
+        self.log_L = log_L[order] 
+        self.weights = weights[order] 
+        self.pixels_per_bin = pixels_per_bin 
+        self._view = None 
+        self.set_data(np.ma.masked_all((1, 1))) 
+
+    # Total weight per dex^2 in each bin of the current view (rows from the bottom of the axes, columns from the left),
+    # with empty bins masked so they're transparent 
+    def bin(self): 
+        ax = self.axes 
+        x0, x1 = np.log10(ax.get_xlim()) 
+        y0, y1 = np.log10(ax.get_ylim()) 
+        nx = max(int(ax.bbox.width / self.pixels_per_bin), 1) 
+        ny = max(int(ax.bbox.height / self.pixels_per_bin), 1) 
+
+        start, stop = np.searchsorted(self.log_Teff, [min(x0, x1), max(x0, x1)]) 
+        ix = np.floor((self.log_Teff[start:stop] - x0) / (x1 - x0) * nx).astype(int) 
+        iy = np.floor((self.log_L[start:stop] - y0) / (y1 - y0) * ny).astype(int) 
+        in_view = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny) 
+        counts = np.bincount(iy[in_view]*nx + ix[in_view], weights=self.weights[start:stop][in_view], minlength=nx*ny) 
+
+        density = counts.reshape(ny, nx) / (abs(x1 - x0)/nx * abs(y1 - y0)/ny) 
+        return np.ma.masked_less_equal(density, 0) 
+
+    def draw(self, renderer): 
+        view = (self.axes.get_xlim(), self.axes.get_ylim(), self.axes.bbox.width, self.axes.bbox.height) 
+        if view != self._view: 
+            self._view = view 
+            self.set_data(self.bin()) 
+        super().draw(renderer) 
+
+
+
+
+
+
+
+
+
+
+# Time each sample of a track stands for: half the time to the sample before it plus half the time to the one after it
+# (NaN ages, i.e. EEPs a track doesn't reach, get NaN) 
+def _time_steps(star_age): 
+    steps = np.full(len(star_age), np.nan) 
+    valid = np.flatnonzero(np.isfinite(star_age)) 
+    if len(valid) > 1: 
+        steps[valid] = np.gradient(star_age[valid]) 
+    return steps 
+
+
+
 class HRDiagram: 
 
     def __init__(self): 
 
-        self.fig, self.ax = plt.subplots(figsize=(10.7, 7))
-        self.fig.subplots_adjust(top=0.87, bottom=0.15, left=0.12, right=0.96)
+        # Every HR diagram reuses the same figure, see figure_reuse 
+        self.fig, self.ax = figure_reuse.get_figure("hr", figsize=(10.7, 7), top=0.87, bottom=0.15, left=0.12, right=0.96)
 
 
         # X axis: Temperature 
@@ -250,9 +354,16 @@ class HRDiagram:
 
 
     def add_path(self, history, color="tab:blue", label=None, lw=2, alpha=1): 
-        self.ax.plot(
-            10**history.log_Teff, 
-            10**history.log_L, 
+        self.add_track(history.log_Teff, history.log_L, color=color, label=label, lw=lw, alpha=alpha) 
+
+
+
+    # Same as add_path, but from arrays (i.e. one mass of an EEP cube: cube.column("log_Teff")[i, cube.segment("MS")]) 
+    def add_track(self, log_Teff, log_L, color="tab:blue", label=None, lw=2, alpha=1): 
+        figure_reuse.plot_line(
+            self.ax, 
+            10**log_Teff, 
+            10**log_L, 
             color=color, 
             label=label, 
             lw=lw, 
@@ -260,6 +371,72 @@ class HRDiagram:
 
 
 
+    # Tracks of any number of masses as one artist, colored by mass with cmap (log scale), with a colorbar of mass 
+    # log_Teffs, log_Ls: one array per mass (or 2D arrays, one row per mass, i.e. cube.column("log_Teff")[:, cube.segment("MS")]) 
+    # highlight: masses drawn opaque and on top (see TrackCollection.highlight), the rest are drawn with alpha 
+    def add_paths(self, log_Teffs, log_Ls, masses, highlight=None, cmap="viridis", lw=2, alpha=0.3, colorbar=True): 
+        masses = np.asarray(masses, dtype=float) 
+        tracks = [np.column_stack([10**np.asarray(log_Teff), 10**np.asarray(log_L)]) for log_Teff, log_L in zip(log_Teffs, log_Ls)] 
+        norm = mcolors.LogNorm(vmin=np.min(masses), vmax=np.max(masses)) if np.min(masses) < np.max(masses) else None 
+
+        collection = LineCollection(tracks, cmap=cmap, norm=norm, linewidths=lw) 
+        collection.set_array(masses) 
+        self.ax.add_collection(collection, autolim=False) 
+        paths = TrackCollection(collection, tracks, masses, alpha) 
+
+        # Colorbar inside the plot, in the hot and very luminous corner (empty unless the grid has very massive stars) 
+        # Every mass is a tick if there are only a few, and the highlighted masses are marked with a black line 
+        if colorbar: 
+            cax = self.ax.inset_axes([0.04, 0.90, 0.36, 0.03]) 
+            cbar = self.fig.colorbar(collection, cax=cax, orientation="horizontal") 
+            cbar.set_label("Initial mass ($M_{{sun}}$)", fontsize=12) 
+            cax.tick_params(labelsize=10) 
+            if len(masses) <= 10: 
+                cbar.set_ticks(masses, labels=[f"{M:g}" for M in masses]) 
+                cbar.minorticks_off() 
+            paths.marker, = cax.plot([], [], color="black", lw=3, scalex=False, scaley=False) 
+
+        paths.highlight(highlight) 
+        return paths 
+
+
+
+    # Density of every sample of many tracks (i.e. a whole grid, or a synthetic population) as one image, for when there are too 
+    # many tracks to draw as lines. See DensityImage. Bins are colored by the number of samples in them, or with star_ages 
+    # (one array per track, like log_Teffs), by the time the stars spend there (each sample weighted by its time step) 
+    # Example usage: hr.add_density(cube.column("log_Teff"), cube.column("log_L"), star_ages=cube.column("star_age")) 
+    def add_density(self, log_Teffs, log_Ls, star_ages=None, cmap="viridis", pixels_per_bin=2, alpha=1): 
+        log_Teff = np.concatenate([np.ravel(track) for track in log_Teffs]) 
+        log_L = np.concatenate([np.ravel(track) for track in log_Ls]) 
+        if star_ages is None: 
+            weights = np.ones(len(log_Teff)) 
+        else: 
+            weights = np.concatenate([_time_steps(np.asarray(ages, dtype=float)) for ages in star_ages]) 
+
+        finite = np.isfinite(log_Teff) & np.isfinite(log_L) & np.isfinite(weights) 
+        image = DensityImage(self.ax, log_Teff[finite], log_L[finite], weights[finite], cmap=cmap, pixels_per_bin=pixels_per_bin, alpha=alpha) 
+        self.ax.add_image(image) 
+        return image 
+
+
+
+    # Isochrone for a stellar population of one age (years), interpolated from the grid (see utils/isochrones.py) 
+    def add_isochrone(self, age, color="black", label=None, lw=2, alpha=1, ls="--"): 
+        iso = isochrones.isochrone(age) 
+        if label is None: 
+            label = f"{helpers.to_engineering(age)} yr isochrone" 
+        figure_reuse.plot_line(
+            self.ax, 
+            10**iso.log_Teff, 
+            10**iso.log_L, 
+            color=color, 
+            label=label, 
+            lw=lw, 
+            alpha=alpha, 
+            ls=ls)
+
+
+
     def legend(self): 
         self.ax.legend(fontsize=14) 
 
@@ -280,7 +457,7 @@ class HRDiagram:
         ax_labels.tick_params(length=0, which="minor", labelsize=14)  
 
         for spectral_type in plot_options.SPECTRAL_TYPES: 
-            plt.axvspan(spectral_type.temp_range[1], spectral_type.temp_range[0], color=spectral_type.color, alpha=0.05)
+            self.ax.axvspan(spectral_type.temp_range[1], spectral_type.temp_range[0], color=spectral_type.color, alpha=0.05)
 
 
 
@@ -0,0 +1,128 @@
+import numpy as np
+
+import utils.plotting.figure_reuse as figure_reuse
+
+
+
+
+
+# Pixel-aware downsampling for line plots with many points (histories with 100k+ rows, profiles with tens of thousands of zones).
+# A line can't show more detail than the pixels it's drawn on, so for each pixel column of the axes only the first, last,
+# lowest, and highest points in that column are kept (the "M4" method: up to 4 points per pixel).
+# Since every pixel column keeps its extremes and its endpoints, the drawn line looks the same as with all of the points,
+# but drawing costs the same however many points the data has.
+# The points are picked again whenever the x limits change (zooming/panning) or the figure is resized, so zooming in
+# shows the full detail. Lines are only downsampled when there are clearly more points than pixels (MIN_POINTS_PER_PIXEL),
+# so most profiles (a few thousand zones) are drawn exactly as with ax.plot.
+# Plots with downsampled lines should make their legend with downsampling.legend (see below), so it's placed the same as with ax.plot.
+# Example usage (drop-in replacement for ax.plot(x, y, ...)):
+# import utils.plotting.downsampling as downsampling
+# downsampling.plot(ax, history.star_age, 10**history.log_R, lw=2)
+# downsampling.legend(ax, fontsize=14)
+
+POINTS_PER_PIXEL = 4       # first, last, min, and max
+MIN_POINTS = 2000          # Lines with fewer points than this are drawn as they are
+MIN_POINTS_PER_PIXEL = 10  # Lines with fewer points in view than this per pixel column are drawn as they are
+
+
+
+
+
+# Indices of the points to draw for data sorted by x (increasing), with the x limits xlim split into n_bins pixel columns
+# One point just outside each edge of xlim is kept so the line still reaches the edges of the plot
+# Points with a non-finite y (NaN, inf) are always kept, so gaps in the line stay where they are
+def minmax_indices(x, y, xlim, n_bins):
+    lo, hi = min(xlim), max(xlim)
+    i_lo = max(int(np.searchsorted(x, lo, side="left"))-1, 0)
+    i_hi = min(int(np.searchsorted(x, hi, side="right"))+1, len(x))
+    indices = np.arange(i_lo, i_hi)
+    if len(indices) <= MIN_POINTS_PER_PIXEL*n_bins or hi <= lo:
+        return indices
+
+    # Pixel column of each point (-1 and n_bins for the points just outside the edges)
+    finite = np.isfinite(y[indices])
+    bins = np.clip(np.floor((x[indices]-lo) / (hi-lo) * n_bins), -1, n_bins).astype(int)
+    f_indices = indices[finite]
+    f_bins = bins[finite]
+    f_y = y[f_indices]
+
+    # First and last point of each pixel column (points are already in order of x, so bins never decrease)
+    starts = np.flatnonzero(np.r_[True, f_bins[1:] != f_bins[:-1]])
+    ends = np.r_[starts[1:], len(f_bins)] - 1
+
+    # Lowest and highest point of each pixel column: sort by column, then by y within each column
+    order = np.lexsort((f_y, f_bins))
+    i_min = f_indices[order[starts]]
+    i_max = f_indices[order[ends]]
+
+    return np.unique(np.concatenate([f_indices[starts], f_indices[ends], i_min, i_max, indices[~finite]]))
+
+
+
+# Plot a line like ax.plot(x, y, *args, **kwargs), but only draw the points that can be seen at the axes' resolution.
+# x must be sorted (increasing or decreasing, i.e. a profile's mass coordinate goes from the surface to the center);
+# otherwise every point is drawn. Returns the Line2D.
+def plot(ax, x, y, *args, **kwargs):
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # Plotting all of the points first means the data limits (autoscaling) are exactly the same as with ax.plot
+    # (a line left over from the last render of a persistent figure is reused, see figure_reuse)
+    line = figure_reuse.plot_line(ax, x, y, *args, **kwargs)
+    line._full_data = None  # A reused line may still have the last render's data here
+    if len(x) < MIN_POINTS or len(x) != len(y):
+        return line
+
+    # Work with increasing x; for decreasing x, indices are flipped back at the end
+    diffs = np.diff(x)
+    if np.all(diffs >= 0):
+        x_sorted, y_sorted, flipped = x, y, False
+    elif np.all(diffs <= 0):
+        x_sorted, y_sorted, flipped = x[::-1], y[::-1], True
+    else:
+        return line
+    line._full_data = (x, y)
+
+    def update(ax):
+        # Pixel columns are evenly spaced in the axis' scale (i.e. in log10(x) for a log x axis)
+        transform = ax.xaxis.get_transform()
+        x_scaled = transform.transform(x_sorted)
+        xlim_scaled = transform.transform(np.array(ax.get_xlim()))
+        indices = minmax_indices(x_scaled, y_sorted, xlim_scaled, max(int(ax.bbox.width), 1))
+        if flipped:
+            indices = np.sort(len(x)-1-indices)
+            line.set_data(x[indices], y[indices])
+        else:
+            line.set_data(x_sorted[indices], y_sorted[indices])
+
+    update(ax)
+    ax.callbacks.connect("xlim_changed", update)
+
+    # Resizing the figure changes the number of pixel columns: the xlim_changed callbacks are run again then.
+    # Connected once per axes (a persistent figure's axes get new xlim_changed callbacks every render, see figure_reuse)
+    if not hasattr(ax, "_downsampling_resize_cid"):
+        ax._downsampling_resize_cid = ax.figure.canvas.mpl_connect("resize_event", lambda event: ax.callbacks.process("xlim_changed", ax))
+    return line
+
+
+
+# Legend like ax.legend(**kwargs). With loc="best" (the default), matplotlib places the legend where it covers the fewest
+# line vertices, and a downsampled line has fewer vertices than its data in some places, so the legend could end up
+# somewhere else than with ax.plot. Instead, the spot "best" picks for the full-resolution lines is found here (once,
+# so it doesn't move when zooming like a "best" legend would) and the legend is pinned there
+def legend(ax, **kwargs):
+    legend = ax.legend(**kwargs)
+    lines = [line for line in ax.lines if getattr(line, "_full_data", None) is not None]
+    if kwargs.get("loc", "best") not in ["best", 0] or len(lines) == 0 or not hasattr(ax.figure.canvas, "get_renderer"):
+        return legend
+
+    renderer = ax.figure.canvas.get_renderer()
+    shown = [line.get_data() for line in lines]
+    for line in lines:
+        line.set_data(*line._full_data)
+    bbox = legend.get_window_extent(renderer)
+    x, y = legend._find_best_position(bbox.width, bbox.height, renderer)
+    for line, data in zip(lines, shown):
+        line.set_data(*data)
+    legend.set_loc(tuple(ax.transAxes.inverted().transform((x, y))))
+    return legend
@@ -0,0 +1,149 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import utils.lazy_import as lazy_import
+figure_reuse = lazy_import.lazy_module("utils.plotting.figure_reuse")
+
+
+
+# Cache of rendered figures, keyed by what was plotted, so going back to a view that was already shown (same mass, substage,
+# plot option, x axis, ...) returns its figure right away instead of plotting it again.
+# Memory: the figures themselves (so they're still interactive when they're shown again). Once their estimated size is over
+# max_bytes, or there are more than max_figures of them, the least recently used ones are handed back to figure_reuse, which
+# reuses them for the next plots of their type (so once the cache is full, a cache miss doesn't make a new figure).
+# Disk (optional, cache_dir): each figure is also saved as a PNG named after a hash of its key, so a view that was shown in an
+# earlier session is returned as PNG bytes (a static image) without plotting anything. Once the PNGs add up to more than
+# max_disk_bytes, the least recently used ones (oldest modification time; reading a PNG touches it) are deleted.
+# Keys: any tuple of plot parameters with a stable repr. It should include something that changes when the data changes
+# (i.e. load_data.run_signature of each run that's plotted), so a changed run isn't served from the cache.
+# Example usage:
+# cache = figure_cache.FigureCache(max_bytes=128*2**20)
+# key = ("history", "Radius", 1.0, str(load_data.run_signature(1.0)))
+# fig = cache.get(key, lambda: HistoryPlot.radius(history))
+class FigureCache:
+
+    # max_figures: matplotlib warns once more than 20 figures are open, so the default stays under that
+    def __init__(self, max_bytes=128*2**20, max_figures=12, cache_dir=None, max_disk_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self.max_figures = max_figures
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._cache = OrderedDict()  # key -> [figure, nbytes]
+        self._lock = threading.RLock()
+
+    @property
+    def total_bytes(self):
+        return sum(nbytes for _, nbytes in self._cache.values())
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    # The cached figure for key (or its PNG bytes, from the disk cache), otherwise render() is called to make it
+    def get(self, key, render):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0].canvas.manager is not None:  # Unless it was closed with plt.close()
+                self._cache.move_to_end(key)
+                return entry[0]
+
+        png = self._read_png(key)
+        if png is not None:
+            return png
+        return self.put(key, render())
+
+    # Add a figure. It's released from figure_reuse while it's cached, so later plots of the same type don't clear it
+    def put(self, key, fig):
+        figure_reuse.release(fig)
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None and previous[0] is not fig:
+                figure_reuse.reclaim(previous[0])
+            self._cache[key] = [fig, _figure_nbytes(fig)]
+            self._evict()
+        if self.cache_dir is not None:
+            self._write_png(key, fig)
+            self._evict_disk()
+        return fig
+
+    # Drop every cached figure (the disk cache is kept)
+    def clear(self):
+        with self._lock:
+            for fig, _ in self._cache.values():
+                figure_reuse.reclaim(fig)
+            self._cache.clear()
+
+    # Drop least recently used figures until under budget (the most recent one is always kept, even if it alone is too big)
+    def _evict(self):
+        total = self.total_bytes
+        while (total > self.max_bytes or len(self._cache) > self.max_figures) and len(self._cache) > 1:
+            _, (fig, nbytes) = self._cache.popitem(last=False)
+            figure_reuse.reclaim(fig)
+            total -= nbytes
+
+    def _png_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(repr(key).encode()).hexdigest() + ".png")
+
+    def _read_png(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._png_path(key), "rb") as file:
+                png = file.read()
+            os.utime(self._png_path(key))  # Mark it as recently used (access times often aren't updated)
+            return png
+        except OSError:
+            return None
+
+    # Written to a temporary file first, so a half-written PNG is never read
+    def _write_png(self, key, fig):
+        path = self._png_path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png")
+            with open(path + ".tmp", "wb") as file:
+                file.write(buffer.getvalue())
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass  # The disk cache is optional: the figure is still cached in memory
+
+    # Delete least recently used PNGs until under max_disk_bytes (i.e. views of an old version of a run that's still going)
+    # The most recent one is always kept, even if it alone is too big
+    def _evict_disk(self):
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith(".png")]
+            stats = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+        except OSError:
+            return
+        total = 0
+        for i, (_, size, path) in enumerate(stats):
+            total += size
+            if total > self.max_disk_bytes and i > 0:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+
+# Rough memory used by a figure: its canvas's RGBA buffer (once drawn) plus the data of its lines, collections, and images
+def _figure_nbytes(fig):
+    width, height = fig.canvas.get_width_height()
+    nbytes = 4 * width * height
+    for ax in fig.axes:
+        for line in ax.lines:
+            nbytes += 3 * np.asarray(line.get_xydata()).nbytes  # x, y, and the path's vertices
+        for collection in ax.collections:
+            nbytes += np.asarray(collection.get_offsets()).nbytes
+            nbytes += sum(path.vertices.nbytes for path in collection.get_paths())
+        for image in ax.images:
+            nbytes += np.asarray(image.get_array()).nbytes
+    return nbytes
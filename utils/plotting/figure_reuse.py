@@ -0,0 +1,166 @@
+import contextlib
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from matplotlib import cbook
+from matplotlib.lines import Line2D
+
+
+
+# Persistent figures: each plot type (history plots, profile plots, the HR diagram) draws into one figure that is kept
+# between re-renders, instead of a new plt.subplots() every time a selection changes. Re-rendering clears what the last
+# plot added (text, patches, legends, secondary axes, callbacks) but keeps the figure, axes, and tick machinery, and the
+# data lines are reused: plot_line() takes the next line left over from the last render and swaps in the new data and style.
+# Figures that are built from scratch every time (i.e. the flowchart) are passed to close_superseded(), which closes the
+# previous one, so pyplot never holds more than one figure per key.
+# Example usage (inside a plotting function):
+# fig, ax = figure_reuse.get_figure("history", figsize=(10.7, 5), top=0.80, bottom=0.16, left=0.10, right=0.95)
+# figure_reuse.plot_line(ax, x, y, lw=2, label="Radius")
+reuse_figures = True  # Set to False to get a new figure from every plot (i.e. to keep several plots of the same type open)
+
+_figures = {}     # key -> persistent figure
+_spares = {}      # key -> figures handed back with reclaim(), used before making a new figure
+MAX_SPARES = 2    # Spare figures kept per key (more are closed)
+_superseded = {}  # key -> last figure passed to close_superseded
+_namespace = ""
+
+
+
+
+
+# Prefix the keys of every figure made inside the with block, so two parts of the app that show the same plot type
+# (i.e. the main plot and the live run plot) each get their own persistent figure
+@contextlib.contextmanager
+def namespace(prefix):
+    global _namespace
+    previous = _namespace
+    _namespace = f"{previous}{prefix}/"
+    try:
+        yield
+    finally:
+        _namespace = previous
+
+
+
+# A figure closed with plt.close() loses its manager (its number can be taken by a new figure, so fignum_exists isn't enough)
+def _is_open(fig):
+    return fig.canvas.manager is not None and plt.fignum_exists(fig.number)
+
+
+
+# The persistent figure and axes for a plot type, cleared of whatever the last plot drew. subplots_adjust: only used
+# the first time (when the figure is created)
+# If the persistent figure was released (i.e. it's held by a figure_cache), a spare figure handed back with reclaim() is used
+def get_figure(key, figsize, **subplots_adjust):
+    key = _namespace + key
+    fig = _figures.get(key) if reuse_figures else None
+    if reuse_figures and (fig is None or not _is_open(fig)):
+        spares = [spare for spare in _spares.get(key, []) if _is_open(spare)]
+        fig = spares.pop() if len(spares) > 0 else None
+        _spares[key] = spares
+        if fig is not None:
+            _figures[key] = fig
+    if fig is not None and _is_open(fig):
+        plt.figure(fig)  # Make it the current figure, same as a new one from plt.subplots (for plt.* calls on the current axes)
+        ax = fig.axes[0]
+        _reset(fig, ax)
+        return fig, ax
+
+    fig, ax = plt.subplots(figsize=figsize)
+    fig.subplots_adjust(**subplots_adjust)
+    fig._reuse_key = key
+    if reuse_figures:
+        _figures[key] = fig
+    return fig, ax
+
+
+
+# Remove everything the last plot added. Lines drawn with plot_line are kept aside to be reused by the next plot
+def _reset(fig, ax):
+    if not hasattr(ax, "_line_pool"):
+        ax._line_pool = []
+    # Child axes first: removing a colorbar's axes looks up the axes of the artist it's for (which has to still be on them)
+    for child_ax in list(ax.child_axes):
+        if not getattr(child_ax, "_reusable", False):  # i.e. history plots' model label axis, which every history plot has
+            child_ax.remove()
+    for line in list(ax.lines):
+        line.remove()
+        if getattr(line, "_reusable", False):
+            ax._line_pool.append(line)
+    for artist in list(ax.texts) + list(ax.patches) + list(ax.collections) + list(ax.images) + list(fig.texts):
+        artist.remove()
+    if ax.legend_ is not None:
+        ax.legend_.remove()
+
+    # Callbacks from the last plot (i.e. downsampling) would otherwise keep running on the new data
+    ax.callbacks = cbook.CallbackRegistry(signals=["xlim_changed", "ylim_changed", "zlim_changed"])
+    ax._color_index = 0
+    ax.relim()
+    ax.set_autoscale_on(True)
+
+
+
+# Like ax.plot(x, y, **kwargs) for one line, but reuses a line from the last render of this figure if there is one
+# Lines without a color get the next color of the color cycle, same as ax.plot on a new figure
+# (with a format string, i.e. plot_line(ax, x, y, "k--"), a new line is always made)
+def plot_line(ax, x, y, *args, **kwargs):
+    if len(args) > 0:
+        line, = ax.plot(x, y, *args, **kwargs)
+        return line
+    if "color" not in kwargs and "c" not in kwargs:
+        colors = mpl.rcParams["axes.prop_cycle"].by_key().get("color", ["C0"])
+        i = getattr(ax, "_color_index", 0)
+        kwargs["color"] = colors[i % len(colors)]
+        ax._color_index = i+1
+    if "label" not in kwargs:
+        kwargs["label"] = "_nolegend_"
+
+    pool = getattr(ax, "_line_pool", [])
+    if len(pool) == 0:
+        line, = ax.plot(x, y, **kwargs)
+        line._reusable = True
+        return line
+
+    # Copy the style from a new (never drawn) line, then put the reused line back on the axes with the new data
+    # (add_line sets its transform and clipping and updates the data limits; autoscale_view rescales like ax.plot does)
+    line = pool.pop(0)
+    line.update_from(Line2D([], [], **kwargs))
+    line.set_data(x, y)
+    ax.add_line(line)
+    ax.autoscale_view()
+    return line
+
+
+
+# Stop reusing a figure (i.e. it's being kept in a figure_cache), so the next plot of its type gets a new figure instead of clearing this one
+def release(fig):
+    for key in [key for key, stored in _figures.items() if stored is fig]:
+        del _figures[key]
+    return fig
+
+
+
+# Hand back a released figure that isn't needed anymore (i.e. evicted from a figure_cache), so the next plot of its type
+# reuses it instead of making a new figure. Figures that didn't come from get_figure (or when there are enough spares) are closed
+def reclaim(fig):
+    if any(stored is fig for stored in _figures.values()):
+        return  # Still the persistent figure of its type
+    key = getattr(fig, "_reuse_key", None)
+    spares = _spares.setdefault(key, [])
+    if fig in spares:
+        return
+    if not reuse_figures or key is None or not _is_open(fig) or len(spares) >= MAX_SPARES:
+        plt.close(fig)
+        return
+    spares.append(fig)
+
+
+
+# For figures made from scratch every time: close the figure that was last passed with this key (if it's a different one)
+def close_superseded(key, fig):
+    key = _namespace + key
+    previous = _superseded.get(key)
+    if previous is not None and previous is not fig:
+        plt.close(previous)
+    _superseded[key] = fig
+    return fig
@@ -1,11 +1,12 @@
 import numpy as np 
 from dataclasses import dataclass 
 
-import matplotlib.pyplot as plt 
 import matplotlib.ticker as mticker 
 
 import utils.helpers as helpers 
 import utils.config.plot_options as plot_options 
+import utils.plotting.downsampling as downsampling 
+import utils.plotting.figure_reuse as figure_reuse 
 
 
 
@@ -32,9 +33,8 @@ class HistoryPlot:
     @staticmethod
     def _setup(history, config): 
 
-        # Initialize figure 
-        fig, ax = plt.subplots(figsize=(10.7, 5))
-        fig.subplots_adjust(top=0.80, bottom=0.16, left=0.10, right=0.95)
+        # Initialize figure (every history plot reuses the same figure, see figure_reuse) 
+        fig, ax = figure_reuse.get_figure("history", figsize=(10.7, 5), top=0.80, bottom=0.16, left=0.10, right=0.95)
 
         # xlabel, xlim, xaxis formatter
         ax.set_xlabel("Age (years)", fontsize=18, labelpad=14)
@@ -84,7 +84,8 @@ class HistoryPlot:
 
             # Only plot profiles that are significant
             if np.nanmax(composition_history) > 0.01:
-                ax.plot(
+                downsampling.plot(
+                    ax,
                     history.star_age,
                     composition_history,
                     label=isotope.label,
@@ -93,7 +94,7 @@ class HistoryPlot:
                 )  
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
     
@@ -112,9 +113,9 @@ class HistoryPlot:
         fig, ax = cls._setup(history, config)
         
         # 3 fusion rates: Hydrogen, helium, and everything else (aka metals) 
-        ax.plot(history.star_age, 10**history.log_LH, lw=2, label="Hydrogen", color="tab:blue")
-        ax.plot(history.star_age, 10**history.log_LHe, lw=2, label="Helium", color="tab:green")
-        ax.plot(history.star_age, 10**history.log_LZ, lw=2, label="Metals", color="tab:red")
+        downsampling.plot(ax, history.star_age, 10**history.log_LH, lw=2, label="Hydrogen", color="tab:blue")
+        downsampling.plot(ax, history.star_age, 10**history.log_LHe, lw=2, label="Helium", color="tab:green")
+        downsampling.plot(ax, history.star_age, 10**history.log_LZ, lw=2, label="Metals", color="tab:red")
 
         # Use mass-luminosity relation on the MS to predict the range of fusion rates to use for y limits 
         L_guess = helpers.mass_luminosity_relation(history.star_mass[0]) 
@@ -123,7 +124,7 @@ class HistoryPlot:
             10**( np.log10(L_guess)+4 ) ) 
         
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
 
@@ -142,7 +143,7 @@ class HistoryPlot:
         fig, ax = cls._setup(history, config)
 
         # Plot radius vs age         
-        ax.plot(history.star_age, 10**history.log_R, lw=2) 
+        downsampling.plot(ax, history.star_age, 10**history.log_R, lw=2) 
 
         return fig 
     
@@ -150,66 +151,100 @@ class HistoryPlot:
 
 
 
-def add_model_labels_time(ax, history):
-    """
-    Adds a secondary x-axis with major (labeled) and 
-    minor (unlabeled) ticks showing where models are available.
-    """
+# Rows of the model ticks to show between xmin and xmax (ages must be sorted). Labeled (major) ticks must be at least
+# min_labeled_spacing (a fraction of the axis) apart, and every tick at least min_unlabeled_spacing from the tick before it.
+# The next tick is found with one searchsorted per tick (the first age past the nearer of the two thresholds), so the cost
+# depends on the number of ticks that fit on the axis, not on the number of models
+def model_tick_rows(ages, xmin, xmax, min_labeled_spacing=0.02, min_unlabeled_spacing=0.004):
+    xmin, xmax = min(xmin, xmax), max(xmin, xmax)
+    start = np.searchsorted(ages, xmin, side="left")
+    stop = np.searchsorted(ages, xmax, side="right")
+    if start >= stop:
+        return np.array([], dtype=int), np.array([], dtype=int)
 
-    # X locations of ticks = ages, labels above ticks = model numbers 
-    all_models = history.model_numbers_available
-    all_ages = history.star_age[all_models - 1]
+    labeled_spacing = (xmax - xmin)*min_labeled_spacing
+    unlabeled_spacing = (xmax - xmin)*min_unlabeled_spacing
+    major_rows = [start]
+    minor_rows = []
+    last_labeled = last_tick = ages[start]
+    while True:
+        i = np.searchsorted(ages, min(last_labeled + labeled_spacing, last_tick + unlabeled_spacing), side="right")
+        if i >= stop:
+            break
+        if ages[i] > last_labeled + labeled_spacing:
+            major_rows.append(i)
+            last_labeled = ages[i]
+        else:
+            minor_rows.append(i)
+        last_tick = ages[i]
+    return np.array(major_rows), np.array(minor_rows)
 
-    def update_secondary_axis(event_ax):
-        if hasattr(ax, "_model_label_ax2"):
-            ax._model_label_ax2.remove()
 
-        # Calculate which ages and modelnums are actually in view of the current plot window 
-        xmin, xmax = ax.get_xlim()
-        indices_in_view = np.where((all_ages >= xmin) & (all_ages <= xmax))
-        ages_in_view = all_ages[indices_in_view]
-        models_in_view = all_models[indices_in_view]
 
-        if len(ages_in_view) == 0:
-            ax.figure.canvas.draw_idle()
-            return
+# Model ticks of the current view, shared by the major and minor locators so they're only computed once per view
+class ModelTicks:
+    def __init__(self, ages, models):
+        order = np.argsort(ages, kind="stable")
+        self.ages = np.asarray(ages)[order]
+        self.models = np.asarray(models)[order]
+        self._view = None
+
+    def rows(self, xmin, xmax):
+        if self._view != (xmin, xmax):
+            self._view = (xmin, xmax)
+            self._rows = model_tick_rows(self.ages, xmin, xmax)
+        return self._rows
+
 
-        ax2 = ax.secondary_xaxis('top') 
 
-        # Calculate location and labels of ticks 
-        current_xmin, current_xmax = ax.get_xlim() 
-        min_labeled_spacing = 0.02 # Fraction of the axis that major ticks must be spaced out
-        min_unlabeled_spacing = min_labeled_spacing/5 # Fraction of the axis that minor ticks must be spaced out 
-        tick_ages = [ages_in_view[0]] 
-        tick_labels = [models_in_view[0]] 
-        ages_with_labels = [ages_in_view[0]]
+class ModelTickLocator(mticker.Locator):
+    def __init__(self, model_ticks, labeled):
+        self.model_ticks = model_ticks
+        self.labeled = labeled
 
-        for i in np.arange(1, len(ages_in_view)): 
-            age = ages_in_view[i] 
-            model = models_in_view[i] 
+    def __call__(self):
+        major_rows, minor_rows = self.model_ticks.rows(*self.axis.get_view_interval())
+        return self.model_ticks.ages[major_rows if self.labeled else minor_rows]
 
-            # 1. MAJOR TICKS: If next tick is far enough away for labels to not overlap  
-            if age > ages_with_labels[-1] + (current_xmax - current_xmin)*min_labeled_spacing: 
-                tick_ages.append(age) 
-                tick_labels.append(model) 
-                ages_with_labels.append(age)
 
-            # 2. MINOR TICKS: If next tick is not far enough away to be labeled but is far enough away to add a minor tick 
-            elif age > tick_ages[-1] + (current_xmax - current_xmin)*min_unlabeled_spacing: 
-                tick_ages.append(age) 
-                tick_labels.append("")
 
-        ax2.set_xticks(tick_ages)
-        ax2.set_xticklabels(tick_labels, fontsize=6, rotation=90)
-        ax2.tick_params(which='major', length=4)
+class ModelTickFormatter(mticker.Formatter):
+    def __init__(self, model_ticks):
+        self.model_ticks = model_ticks
 
+    def __call__(self, x, pos=None):
+        ages = self.model_ticks.ages
+        i = min(np.searchsorted(ages, x), len(ages)-1)
+        return str(self.model_ticks.models[i]) if ages[i] == x else ""
 
-        # --- Final cleanup ---
-        ax._model_label_ax2 = ax2
-        ax.figure.canvas.draw_idle()
 
-    ax.callbacks.connect('xlim_changed', update_secondary_axis)
-    update_secondary_axis(ax)
+
+def add_model_labels_time(ax, history):
+    """
+    Adds a secondary x-axis with major (labeled) and 
+    minor (unlabeled) ticks showing where models are available.
+    """
+
+    # X locations of ticks = ages, labels above ticks = model numbers 
+    all_models = history.model_numbers_available
+    all_ages = history.star_age[helpers.model_rows(history, all_models)]
+    model_ticks = ModelTicks(all_ages, all_models)
+
+    # The ticks come from locators, which matplotlib calls when the axis is drawn: zooming or panning just redraws the same
+    # secondary axis, and a burst of xlim changes between two draws only computes the ticks once (for the view that's drawn) 
+    # The secondary axis is only made once per figure: when a figure is reused (see figure_reuse), it keeps its secondary axis 
+    # and only the models behind the ticks are swapped 
+    ax2 = getattr(ax, "_model_label_ax2", None)
+    if ax2 is None or ax2 not in ax.child_axes:
+        ax2 = ax.secondary_xaxis('top') 
+        ax2._reusable = True 
+    ax2.xaxis.set_major_locator(ModelTickLocator(model_ticks, labeled=True))
+    ax2.xaxis.set_minor_locator(ModelTickLocator(model_ticks, labeled=False))
+    ax2.xaxis.set_major_formatter(ModelTickFormatter(model_ticks))
+    ax2.xaxis.set_minor_formatter(mticker.NullFormatter())
+    ax2.tick_params(axis='x', which='major', labelsize=6, labelrotation=90, length=4)
+    ax2.tick_params(axis='x', which='minor', length=4)
+    ax._model_label_ax2 = ax2
 
 
 
@@ -219,10 +254,10 @@ def add_substage_highlight(fig, model_selected, history):
     ax = fig.axes[0] 
     if model_selected.model_start is not None: 
         ax.axvspan(
-            history.star_age[model_selected.model_start-1], 
-            history.star_age[model_selected.model_end-1], 
+            history.star_age[helpers.model_rows(history, model_selected.model_start)], 
+            history.star_age[helpers.model_rows(history, model_selected.model_end)], 
             color=model_selected.parent_substage.flowchart_color, alpha=0.1, 
             label=model_selected.parent_substage.flowchart_text) 
-        ax.legend() 
+        downsampling.legend(ax) 
 
 
@@ -0,0 +1,210 @@
+import time
+import argparse
+from fractions import Fraction
+
+import numpy as np
+
+import utils.plotting.HR_diagram_plotting as HR_diagram_plotting
+
+
+
+# Micro-benchmark of HR_diagram_plotting.calc_log_ticks (what the HR diagram's log locators call on every draw) against
+# the original version (reference_calc_log_ticks below, kept as it was), over a sweep of zoom ranges on the Teff axis:
+# views centered across the HR diagram, from the full diagram (about 1.5 decades) down to a few kelvin wide.
+# Reports the time per call of the original, of the new one without its cache (_compute_log_ticks), and of the new one when
+# the view was already seen (what redrawing the same view costs), and checks that every version gives the same ticks.
+# Example usage (from the repo folder):
+# python -m utils.plotting.log_ticks_benchmark
+# python -m utils.plotting.log_ticks_benchmark --views 500 --repeat 5
+
+
+
+
+
+# The original calc_log_ticks, for comparison
+def reference_calc_log_ticks(left, right, remove_overlaps=True):
+    xmin = np.min([left, right])
+    xmax = np.max([left, right])
+
+
+
+    def calc_next_depth(depth): 
+        if depth == 0: 
+            return 1 
+        exp = int(np.floor(np.log10(depth)))
+        mant = depth / (10**exp)  
+        if mant == 1: 
+            return int(depth*2) 
+        if mant == 2: 
+            return int(depth*2.5)
+        if mant == 5: 
+            return int(depth*2) 
+        
+
+
+    def calc_gaps(input_array, minmax_func=np.min): 
+
+        # Get sorting indices
+        sort_idx = np.argsort(input_array)
+        sorted_array = input_array[sort_idx]
+
+        # Calculate gaps 
+        gaps = [] 
+        for i in range(len(sorted_array)): 
+            if i==0: 
+                gap = np.log10(sorted_array[1]/sorted_array[0])
+            elif i==len(sorted_array)-1: 
+                gap = np.log10(sorted_array[i]/sorted_array[i-1])
+            else: 
+                next_gap = np.log10(sorted_array[i+1] / sorted_array[i])
+                prev_gap = np.log10(sorted_array[i] / sorted_array[i-1])
+                gap = minmax_func([next_gap, prev_gap])
+            gaps.append(gap)
+        gaps = np.array(gaps)
+
+        # Invert the sorting to get back to original order
+        inverse_idx = np.argsort(sort_idx)
+        unsorted_gaps = gaps[inverse_idx]
+
+        return unsorted_gaps 
+
+
+
+    start_exp = int(np.floor(np.log10(xmin)))
+    stop_exp = int(np.floor(np.log10(xmax)))
+    depth = 0 
+    f_max = 0.5  
+    f_min = 0.1
+    length = np.log10(xmax / xmin) 
+    array = np.array([]) 
+    gaps = np.array([length]) 
+
+
+
+    # Keep subdividing until the largest gap between ticks is smaller than f_max 
+    # This will mean the smallest gaps are way too small, but we will remove those points in the next step 
+    while len(array) < 4 or (np.max(gaps)>f_max*length):
+
+        depth = calc_next_depth(depth) 
+
+        arrs = []
+        for k in range(start_exp, stop_exp+1):
+            base = 10**k
+            step = base / depth   # e.g. depth=2 → 500, depth=5 → 200
+            arr = np.arange(base, 10*base + step, step)
+            arrs.append(arr)
+
+        array = np.unique(np.concatenate(arrs))
+        array = array[(array >= xmin) & (array <= xmax)]
+        array = np.append(array, xmin)
+        array = np.append(array, xmax) 
+        array = np.unique(array) 
+        array = np.sort(array) 
+
+        gaps = calc_gaps(array, minmax_func=np.max) 
+
+
+
+    # First, check if we even want to remove overlapping points. 
+    # If this is for minor tick LINES, leave overlapping points in so the gridline spacing 
+    # matches what you would expect for a log plot, but for major tick LABELS, we don't want any text to overlap. 
+    # When removing overlapping points, prioritize keeping "nicer" numbers. 
+    # Example: If 5, 6, 7, 8, 9, 10, 20, 30, 40, 50, 60 etc were the initial labels: 
+    # First get rid of 0.1 numbers (what's left: 6, 8, 10, 20, 40, etc)
+    # Then get rid of 0.2 numbers (what's left: 5, 10, 15, 20, 25)
+    # Then get rid of 0.5 numbers (what's left: 10, 100, 1000) 
+    # Prioritize keeping 0.0
+    # Keep removing points until no remaining labels are overlapping/too close 
+    while remove_overlaps==True:
+
+        gaps = calc_gaps(array) 
+
+        if len(gaps) < 1 or np.min(gaps) >= f_min*length:
+            break 
+
+        array_too_close = array[np.where(gaps<f_min*length)]
+
+        exp = np.floor(np.log10(array_too_close)) 
+        mant = array_too_close / (10**exp) 
+        dec = np.array([round(x%1, 10) for x in mant])
+        denoms = np.array([Fraction(x).limit_denominator(100).denominator for x in dec])
+
+        array_least_significant = array_too_close[np.where(denoms==np.max(denoms))] 
+        ind_removal_candidates = np.array([np.where(array==x)[0][0] for x in array_least_significant]) 
+        ind_remove = np.where(array == array[ind_removal_candidates][np.argmin(np.array(gaps)[ind_removal_candidates])])[0][0]
+
+        array = np.delete(array, ind_remove)
+
+    return array
+
+
+
+
+# Views (left, right) of the sweep: n_centers centers log-spaced across the diagram, times n_widths widths log-spaced
+# from max_width down to min_width decades. Left > right, like the HR diagram's inverted Teff axis
+def zoom_sweep(n_views=200, min_width=1e-3, max_width=1.5):
+    n_widths = max(int(np.sqrt(n_views)), 1)
+    n_centers = max(n_views // n_widths, 1)
+    centers = np.linspace(np.log10(3000), np.log10(40000), n_centers)
+    widths = np.logspace(np.log10(max_width), np.log10(min_width), n_widths)
+    return [(10**(c + w/2), 10**(c - w/2)) for c in centers for w in widths]
+
+
+
+# Seconds per call of func(left, right, remove_overlaps) over the views (best of `repeat` passes)
+def time_per_call(func, views, remove_overlaps, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for left, right in views:
+            func(left, right, remove_overlaps)
+        best = min(best, time.perf_counter() - start)
+    return best / len(views)
+
+
+
+# Seconds per call of func(left, right, remove_overlaps) for a view that was just computed (i.e. redrawing the same view)
+def time_per_redraw(func, views, remove_overlaps):
+    total = 0
+    for left, right in views:
+        func(left, right, remove_overlaps)
+        start = time.perf_counter()
+        func(left, right, remove_overlaps)
+        total += time.perf_counter() - start
+    return total / len(views)
+
+
+
+def benchmark(n_views=200, repeat=3):
+    views = zoom_sweep(n_views)
+
+    # Same ticks as the original. Both get the view rounded to QUANTIZE_DIGITS (what the new version memoizes on), since a view
+    # where a gap is exactly at the f_max/f_min threshold (i.e. centered on a round number) can go either way with the rounding
+    mismatches = 0
+    for left, right in views:
+        left, right = HR_diagram_plotting._quantize(left), HR_diagram_plotting._quantize(right)
+        for remove_overlaps in (True, False):
+            new = HR_diagram_plotting.calc_log_ticks(left, right, remove_overlaps)
+            reference = reference_calc_log_ticks(left, right, remove_overlaps)
+            if len(new) != len(reference) or not np.allclose(new, reference, rtol=1e-8):
+                mismatches += 1
+
+    print(f"{len(views)} views, {mismatches} with different ticks than the original")
+    print(f"{'ticks':<8} {'original (us)':>14} {'new (us)':>10} {'new, cached (us)':>17} {'speedup':>9} {'cached speedup':>15}")
+    for remove_overlaps, name in [(True, "major"), (False, "minor")]:
+        reference = time_per_call(reference_calc_log_ticks, views, remove_overlaps, repeat)
+        sorted_views = [(min(view), max(view)) for view in views]
+        new = time_per_call(HR_diagram_plotting._compute_log_ticks, sorted_views, remove_overlaps, repeat)
+        cached = time_per_redraw(HR_diagram_plotting.calc_log_ticks, views, remove_overlaps)
+        print(f"{name:<8} {1e6*reference:>14.1f} {1e6*new:>10.1f} {1e6*cached:>17.1f} {reference/new:>8.1f}x {reference/cached:>14.0f}x")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time calc_log_ticks against the original version over a sweep of zoom ranges.")
+    parser.add_argument("--views", type=int, default=200, help="Number of views in the sweep")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the sweep (the fastest is reported)")
+    args = parser.parse_args()
+    benchmark(args.views, args.repeat)
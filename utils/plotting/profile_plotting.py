@@ -1,13 +1,14 @@
 import numpy as np 
 from dataclasses import dataclass 
 
-import matplotlib.pyplot as plt 
 import matplotlib.ticker as mticker 
 from matplotlib.textpath import TextPath
 from matplotlib.font_manager import FontProperties
 
 import utils.config.physical_constants as physical_constants 
 import utils.config.plot_options as plot_options 
+import utils.plotting.downsampling as downsampling 
+import utils.plotting.figure_reuse as figure_reuse 
 
 
 
@@ -38,9 +39,8 @@ class ProfilePlot:
     @staticmethod
     def _setup(profile, xaxis, config): 
 
-        # Create figure 
-        fig, ax = plt.subplots(figsize=(10.7, 5))
-        fig.subplots_adjust(top=0.86, bottom=0.16, left=0.10, right=0.95)
+        # Create figure (every profile plot reuses the same figure, see figure_reuse) 
+        fig, ax = figure_reuse.get_figure("profile", figsize=(10.7, 5), top=0.86, bottom=0.16, left=0.10, right=0.95)
 
         # Select either mass or radius as the x axis 
         x_arr = xaxis.get_values(profile)
@@ -51,6 +51,9 @@ class ProfilePlot:
         ax.set_xlim(0, 1.001*np.max(x_arr))
 
         # Add extra xtick labels to left side (core) and right side (surface) of plot 
+        # (starting from the automatic ticks, since a reused figure still has the last plot's fixed ticks) 
+        ax.xaxis.set_major_locator(mticker.AutoLocator()) 
+        ax.xaxis.set_major_formatter(mticker.ScalarFormatter()) 
         xticks = ax.get_xticks() 
         xticks = np.append(xticks, np.max(x_arr))
         xtick_labels = [
@@ -110,7 +113,8 @@ class ProfilePlot:
 
             # Only plot profiles that are significant
             if np.nanmax(composition_profile) > 0.01:
-                ax.plot(
+                downsampling.plot(
+                    ax,
                     x_arr,
                     composition_profile,
                     label=isotope.label,
@@ -124,7 +128,7 @@ class ProfilePlot:
                 ax.axhline(composition_history[0], color=isotope.color, ls="dashed") 
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
 
@@ -144,13 +148,13 @@ class ProfilePlot:
         x_arr = xaxis.get_values(profile)
         
         # Convection plots 
-        ax.plot(x_arr, 10**profile.log_D_conv, label="Convective", lw=3) 
-        ax.plot(x_arr, 10**profile.log_D_semi, label="Semiconvective", lw=3) 
-        ax.plot(x_arr, 10**profile.log_D_ovr, label="Overshoot", lw=3) 
-        ax.plot(x_arr, 10**profile.log_D_thrm, label="Thermohaline", lw=3) 
+        downsampling.plot(ax, x_arr, 10**profile.log_D_conv, label="Convective", lw=3) 
+        downsampling.plot(ax, x_arr, 10**profile.log_D_semi, label="Semiconvective", lw=3) 
+        downsampling.plot(ax, x_arr, 10**profile.log_D_ovr, label="Overshoot", lw=3) 
+        downsampling.plot(ax, x_arr, 10**profile.log_D_thrm, label="Thermohaline", lw=3) 
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
 
@@ -170,10 +174,10 @@ class ProfilePlot:
         x_arr = xaxis.get_values(profile)
         
         # Plot fusion rates 
-        ax.plot(x_arr, profile.eps_nuc, label = "Total fusion", lw=5, color="black")
-        ax.plot(x_arr, profile.pp, label = "Hydrogen (PP chain)", lw=2, color="tab:blue")
-        ax.plot(x_arr, profile.cno, label = "Hydrogen (CNO cycle)", lw=2, color="tab:orange")
-        ax.plot(x_arr, profile.tri_alfa, label = "Helium (triple alpha)", lw=2, color="tab:green")
+        downsampling.plot(ax, x_arr, profile.eps_nuc, label = "Total fusion", lw=5, color="black")
+        downsampling.plot(ax, x_arr, profile.pp, label = "Hydrogen (PP chain)", lw=2, color="tab:blue")
+        downsampling.plot(ax, x_arr, profile.cno, label = "Hydrogen (CNO cycle)", lw=2, color="tab:orange")
+        downsampling.plot(ax, x_arr, profile.tri_alfa, label = "Helium (triple alpha)", lw=2, color="tab:green")
 
         # Set ylim 
         # Calculate the average ergs/sec/gram of the entire star's mass and luminosity 
@@ -185,7 +189,7 @@ class ProfilePlot:
             ax.set_ylim((specific_L/10, specific_L*1000))
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
     
@@ -205,7 +209,7 @@ class ProfilePlot:
         x_arr = xaxis.get_values(profile)
         
         # Plot mass/particle
-        ax.plot(x_arr, profile.mu, color="black", lw=3, label="Actual") 
+        downsampling.plot(ax, x_arr, profile.mu, color="black", lw=3, label="Actual") 
             
         # Horizontal lines at 1.34 and 0.6 to represent mu of pure helium and mu of envelope 
         ax.axhline(0.62, color="dodgerblue", linestyle="dashed", lw=2, label="Theoretical: typical envelope")
@@ -221,7 +225,7 @@ class ProfilePlot:
         ax.set_ylim((0.5, y_max))
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
     
@@ -243,8 +247,8 @@ class ProfilePlot:
         # Calculate kinetic energy per particle from the temperature (assuming ideal gas) + what it actually is 
         KE_per_N_temp = 3/2*physical_constants.k*10**profile.logT 
         KE_per_N_actual = 3/2 * profile.pressure * profile.mu*physical_constants.m_p / (10**profile.logRho)
-        ax.plot(x_arr, KE_per_N_temp, lw=3, label="Temperature (in energy units)") 
-        ax.plot(x_arr, KE_per_N_actual, lw=3, label="Kinetic Energy / particle") 
+        downsampling.plot(ax, x_arr, KE_per_N_temp, lw=3, label="Temperature (in energy units)") 
+        downsampling.plot(ax, x_arr, KE_per_N_actual, lw=3, label="Kinetic Energy / particle") 
       
         # Set y limit to focus on the core 
         xmax = 0.95*np.max(x_arr) 
@@ -258,7 +262,7 @@ class ProfilePlot:
         ax.set_ylim(ymin, ymax) 
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
     
@@ -278,9 +282,9 @@ class ProfilePlot:
         x_arr = xaxis.get_values(profile)
 
         # 3 temperature gradients: Actual/observed, plus theoretical radiative and adiabatic for comparison 
-        ax.plot(x_arr, profile.gradT, lw=5, color="black", label="Actual") 
-        ax.plot(x_arr, profile.grada, lw=2, color="red", label="Theoretical, adiabatic")
-        ax.plot(x_arr, profile.gradr, lw=2, color="limegreen", label="Theoretical, radiative")
+        downsampling.plot(ax, x_arr, profile.gradT, lw=5, color="black", label="Actual") 
+        downsampling.plot(ax, x_arr, profile.grada, lw=2, color="red", label="Theoretical, adiabatic")
+        downsampling.plot(ax, x_arr, profile.gradr, lw=2, color="limegreen", label="Theoretical, radiative")
 
         # Set ylim         
         old_ymin = min(profile.gradT) 
@@ -294,7 +298,7 @@ class ProfilePlot:
         ax.set_ylim(new_ymin, new_ymax)
 
         # Legend 
-        ax.legend(fontsize=14) 
+        downsampling.legend(ax, fontsize=14) 
 
         return fig 
 
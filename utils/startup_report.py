@@ -0,0 +1,92 @@
+import sys
+import argparse
+import subprocess
+
+
+
+# How long each module the app imports at startup takes to import, so the first frame can be kept fast.
+# Each module is imported in a fresh Python process with -X importtime, so its cost includes everything it pulls in
+# (i.e. matplotlib or pandas), and nothing has been imported by an earlier module yet. Modules over their budget are flagged,
+# along with the heaviest modules they import.
+# Example usage (from the repo folder):
+# python -m utils.startup_report
+# python -m utils.startup_report --top 10 utils.load_data
+
+# Modules imported at startup, before anything is plotted (their heavy dependencies should be deferred, see lazy_import)
+# and how long each may take, in seconds
+STARTUP_MODULES = {
+    "utils.load_data": 0.25,
+    "utils.eep_cube": 0.25,
+    "utils.lazy_import": 0.05,
+    "utils.config.stellar_evolution_data": 0.05,
+    "utils.config.ui_options": 0.25,
+}
+STARTUP_BUDGET = 0.3  # For all of the startup modules together (numpy alone is ~0.1 s)
+
+# The rest, for comparison (these are expected to be slow: they're deferred until they're used)
+DEFERRED_MODULES = [
+    "mesa_reader",
+    "marimo",
+    "matplotlib.pyplot",
+    "utils.plotting.history_plotting",
+    "utils.plotting.profile_plotting",
+    "utils.plotting.HR_diagram_plotting",
+]
+
+
+
+
+
+# Import modules (one name, or a list imported one after another) in a new process.
+# Returns (module, self time, cumulative time, depth) for every module that got imported; times are in seconds, and
+# depth is 0 for modules imported directly, 1 for the modules they import, and so on
+def import_times(modules):
+    modules = [modules] if isinstance(modules, str) else list(modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"], capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), int(self_us)/1e6, int(cumulative_us)/1e6, depth))
+    return times
+
+
+
+# Print the import cost of every module, with the heaviest dependencies of any module that's over its budget
+# (or of every module, with details=True)
+def startup_report(modules=None, top=5, details=False):
+    if modules is None:
+        modules = list(STARTUP_MODULES) + DEFERRED_MODULES
+
+    print(f"{'module':<40} {'import (ms)':>12} {'budget (ms)':>12}")
+    for module in modules:
+        times = import_times(module)
+        cost = next(cumulative for name, _, cumulative, _ in times if name == module)
+        budget = STARTUP_MODULES.get(module)
+        over = budget is not None and cost > budget
+        budget_str = f"{1e3*budget:.0f}" if budget is not None else "deferred"
+        print(f"{module:<40} {1e3*cost:>12.1f} {budget_str:>12}{'  OVER BUDGET' if over else ''}")
+
+        if over or details:
+            heaviest = sorted((t for t in times if t[3] == 1), key=lambda t: -t[2])[:top]
+            for name, _, cumulative, _ in heaviest:
+                print(f"    {name:<36} {1e3*cumulative:>12.1f}")
+
+    # Everything imported at startup, in one process (shared dependencies like numpy only count once)
+    total = sum(cumulative for _, _, cumulative, depth in import_times(list(STARTUP_MODULES)) if depth == 0)
+    over = total > STARTUP_BUDGET
+    print(f"{'all startup modules':<40} {1e3*total:>12.1f} {1e3*STARTUP_BUDGET:>12.0f}{'  OVER BUDGET' if over else ''}")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report how long the app's modules take to import.")
+    parser.add_argument("modules", nargs="*", help="Modules to report (default: the startup and deferred modules)")
+    parser.add_argument("--top", type=int, default=5, help="Number of heaviest dependencies to list for a module")
+    args = parser.parse_args()
+    startup_report(args.modules or None, args.top, details=len(args.modules) > 0)
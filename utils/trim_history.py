@@ -0,0 +1,174 @@
+import os
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+
+import utils.load_data as load_data
+import utils.grid_catalog as grid_catalog
+import utils.evolutionary_events as evolutionary_events
+import utils.config.plot_options as plot_options
+import utils.config.stellar_evolution_data as stellar_evolution_data
+
+
+
+# Make trimmed_history.data from a MESA run's full history.data by dropping rows that wouldn't change any plot.
+# A row is dropped if every column in TRIM_COLUMNS is within its tolerance of the straight line (vs age) between the rows kept
+# on either side of it (Ramer-Douglas-Peucker). Since log_Teff and log_L are both checked against the same age, the HR track
+# is also within tolerance. Rows at evolutionary events, at saved profiles, and at the first and last model are always kept,
+# so events are found at the same model numbers and every profile still has a row in the history.
+# Kept rows are copied byte for byte, so the output is a valid MESA history with exactly the original values.
+# Also writes trimmed_history.map: for each row of the trimmed history, its row in the original file and its model number.
+# Example usage (from the repo folder):
+# python -m utils.trim_history "path/to/LOGS" --mass 1.0
+# python -m utils.trim_history "path/to/LOGS" --output "C:/.../MESA output files/M=1.0/trimmed_history.data"
+
+
+
+
+
+@dataclass
+class TrimColumn:
+    """A history column that must look the same after trimming."""
+    key: str            # The history column (e.g., "log_L")
+    tolerance: float    # Largest allowed difference between a dropped row and the line through the kept rows, in the column's units
+
+
+
+# Log columns are plotted on log axes, so their tolerance is in dex. Compositions are plotted on a linear 0-1 axis
+TRIM_COLUMNS = [
+    TrimColumn(key="log_Teff",  tolerance=0.002),
+    TrimColumn(key="log_L",     tolerance=0.005),
+    TrimColumn(key="log_R",     tolerance=0.005),
+    TrimColumn(key="log_LH",    tolerance=0.01),
+    TrimColumn(key="log_LHe",   tolerance=0.01),
+    TrimColumn(key="log_LZ",    tolerance=0.01),
+    TrimColumn(key="star_mass", tolerance=0.001),
+] + [TrimColumn(key=isotope.history_key, tolerance=0.002) for isotope in plot_options.ISOTOPES]
+
+
+
+
+
+# Rows of y (one row per column, already divided by each column's tolerance) to keep so every dropped row is within 1 of the
+# straight line (vs t) between the kept rows on either side. keep: rows that must be kept. Returns a boolean mask
+def _decimate(t, y, keep):
+    n = len(t)
+    kept = np.zeros(n, dtype=bool)
+    kept[keep] = True
+    kept[[0, n-1]] = True
+
+    # Split each segment between kept rows at its worst row until every row is close enough to its segment's line
+    anchors = np.flatnonzero(kept)
+    segments = list(zip(anchors[:-1], anchors[1:]))
+    while len(segments) > 0:
+        a, b = segments.pop()
+        if b - a < 2:
+            continue
+
+        if t[b] > t[a]:
+            frac = (t[a+1:b] - t[a]) / (t[b] - t[a])
+        else:
+            frac = np.arange(1, b-a) / (b-a)
+        line = y[:, [a]] + frac * (y[:, [b]] - y[:, [a]])
+        deviation = np.max(np.abs(y[:, a+1:b] - line), axis=0)
+        deviation[np.isnan(deviation)] = np.inf # Keep rows where a column has a gap
+
+        i = int(np.argmax(deviation))
+        if deviation[i] > 1:
+            i += a+1
+            kept[i] = True
+            segments += [(a, i), (i, b)]
+
+    return kept
+
+
+
+# Model numbers that a run's substages use (start, end, and example model), so their rows are kept exactly
+def substage_models(mass):
+    models = []
+    for substage in stellar_evolution_data.SUBSTAGES_LIST:
+        for model in substage.models:
+            if abs(model.mass - mass) < 1e-6:
+                models += [m for m in [model.model_start, model.model_end, model.model_example] if m is not None]
+    return sorted(set(models))
+
+
+
+# Write a trimmed copy of a MESA run's history.
+# folder_path: the run's LOGS folder (with history.data and profiles.index)
+# output_filepath: where to write the trimmed history (default: trimmed_history.data in folder_path); the row map is written next to it
+# tolerance: multiplies every TrimColumn.tolerance (i.e. 0.5 keeps more rows, 2 keeps fewer)
+# keep_models: extra model numbers whose rows must be kept (i.e. substage_models(mass))
+# Returns the number of rows in the original and trimmed histories
+def trim_history(folder_path, output_filepath=None, tolerance=1.0, keep_models=None, history_file="history.data"):
+    history_filepath = os.path.join(folder_path, history_file)
+    if output_filepath is None:
+        output_filepath = os.path.join(folder_path, "trimmed_history.data")
+
+    # Read the header and every data line as is, then the columns that are needed
+    with open(history_filepath, "rb") as file:
+        header_lines = [file.readline() for _ in range(6)]
+        lines = file.readlines()
+    if len(lines) > 0 and not lines[-1].endswith(b"\n"):
+        lines = lines[:-1] # Last row is still being written
+    lines = [line for line in lines if line.strip() != b""]
+
+    bulk_names, _, _ = grid_catalog.read_mesa_header(history_filepath)
+    trim_columns = [column for column in TRIM_COLUMNS if column.key in bulk_names]
+    names = load_data.HISTORY_BASE_COLUMNS + [column.key for column in trim_columns]
+    names = [name for name in dict.fromkeys(names) if name in bulk_names]
+    columns = load_data._parse_mesa_rows([line.decode() for line in lines], bulk_names, names)
+
+    # Drop rows that MESA redid after a backup or restart, the same way load_history does
+    original_rows = np.flatnonzero(load_data._backup_mask(columns["model_number"]))
+    columns = {name: values[original_rows] for name, values in columns.items()}
+    history = load_data.MesaColumns(history_filepath, columns, {}, bulk_names)
+    model_number = columns["model_number"]
+
+    # Rows that must be kept: events, saved profiles, and any extra model numbers
+    keep = [index for index in evolutionary_events.find_events([history])[0].values() if index is not None]
+    index_filepath = os.path.join(folder_path, grid_catalog.INDEX_FILE)
+    if os.path.isfile(index_filepath):
+        profile_model_numbers = load_data.MesaFolderIndex(folder_path, history_file).model_numbers
+        keep += [int(row) for row in np.searchsorted(model_number, profile_model_numbers) if row < len(model_number)]
+    if keep_models is not None:
+        keep += [int(row) for row in np.searchsorted(model_number, keep_models) if row < len(model_number)]
+
+    # Decimate
+    t = np.asarray(columns["star_age"], dtype=float)
+    y = np.array([np.asarray(columns[column.key], dtype=float) / (column.tolerance*tolerance) for column in trim_columns])
+    if len(y) == 0:
+        y = np.zeros((1, len(t)))
+    kept_rows = np.flatnonzero(_decimate(t, y, np.array(keep, dtype=int)))
+
+    # Write the trimmed history (copying the original lines) and the map back to the original rows
+    with open(output_filepath + ".tmp", "wb") as file:
+        file.writelines(header_lines)
+        file.writelines(lines[row] for row in original_rows[kept_rows])
+    os.replace(output_filepath + ".tmp", output_filepath)
+
+    map_filepath = os.path.splitext(output_filepath)[0] + ".map"
+    np.savetxt(
+        map_filepath,
+        np.column_stack([np.arange(len(kept_rows)), original_rows[kept_rows], model_number[kept_rows]]),
+        fmt="%d",
+        header=f"Rows of {os.path.basename(output_filepath)} in {history_filepath}\ntrimmed_row original_row model_number")
+
+    return len(lines), len(kept_rows)
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a trimmed_history.data that drops rows which don't change any plot.")
+    parser.add_argument("folder_path", help="MESA LOGS folder with history.data and profiles.index")
+    parser.add_argument("--output", default=None, help="Output file (default: trimmed_history.data in folder_path)")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="Multiplies every column's tolerance")
+    parser.add_argument("--mass", type=float, default=None, help="Also keep the rows of this mass's substage models")
+    args = parser.parse_args()
+
+    keep_models = substage_models(args.mass) if args.mass is not None else None
+    n_original, n_trimmed = trim_history(args.folder_path, args.output, args.tolerance, keep_models)
+    print(f"Kept {n_trimmed} of {n_original} rows ({100*n_trimmed/max(n_original, 1):.1f}%)")